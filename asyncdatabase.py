@@ -0,0 +1,110 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Non-blocking access to a database from coroutines.
+
+Writes are queued to a dedicated writer thread which stores them in batched
+transactions. Reads are served from the entries waiting to be written, or
+run in a thread pool so disk access never stalls the event loop.
+"""
+from typing import Any
+from threading import Thread, Lock
+from queue import Queue, Empty, Full
+from concurrent.futures import ThreadPoolExecutor
+from asyncio import get_running_loop
+from database import Database
+from requestlogging import get_default_logger
+
+# Marks the end of the write queue.
+_STOP_WRITER = object()
+
+
+class AsyncDatabase:
+    """
+    Async facade over a Database with a writer thread and a read thread pool.
+    """
+
+    def __init__(
+        self, database: Database, queue_size: int = 1000, batch_size: int = 100, readers: int = 4
+    ) -> None:
+        self.__database = database
+        self.__batch_size = batch_size
+        self.__queue: Queue = Queue(maxsize=queue_size)
+        # Entries queued but not yet written, newest data per key.
+        self.__pending: dict[Any, dict[Any, Any]] = {}
+        self.__pending_lock = Lock()
+        self.__readers = ThreadPoolExecutor(max_workers=readers)
+        self.__writer = Thread(target=self.__write_entries, daemon=True)
+        self.__writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    @property
+    def database(self) -> Database:
+        return self.__database
+
+    def close(self) -> None:
+        """
+        Waits for all queued writes to be stored and stops the writer thread.
+        Does not close the underlying database.
+        """
+        self.__queue.put(_STOP_WRITER)
+        self.__writer.join()
+        self.__readers.shutdown()
+
+    async def get(self, key: Any) -> Any:
+        with self.__pending_lock:
+            if key in self.__pending:
+                return self.__pending[key]
+
+        return await get_running_loop().run_in_executor(self.__readers, self.__database.get, key)
+
+    async def store_entry(self, key: Any, data: dict[Any, Any]) -> None:
+        """
+        Queues a key with it's data to be stored and adds a timestamp.
+        Only waits if the write queue is full.
+        """
+        Database.stamp_entry(data)
+
+        with self.__pending_lock:
+            self.__pending[key] = data
+
+        try:
+            self.__queue.put_nowait((key, data))
+        except Full:
+            await get_running_loop().run_in_executor(None, self.__queue.put, (key, data))
+
+    def __write_entries(self) -> None:
+        log = get_default_logger()
+        stop = False
+
+        while not stop:
+            batch = [self.__queue.get()]
+
+            while len(batch) < self.__batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except Empty:
+                    break
+
+            stop = _STOP_WRITER in batch
+            entries = [item for item in batch if item is not _STOP_WRITER]
+
+            try:
+                self.__database.store_entries(entries)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Could not store %d database entries", len(entries))
+
+            with self.__pending_lock:
+                for key, data in entries:
+                    # A newer write of the key may have been queued meanwhile.
+                    if self.__pending.get(key) is data:
+                        del self.__pending[key]
+
+        log.debug("Database writer stopped")
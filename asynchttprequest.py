@@ -5,14 +5,40 @@
 
 Provides functionality to make async http requests.
 """
-from typing import Optional, Any, Iterable, Callable, Union
+from typing import Optional, Any, Iterable, Callable, Union, AsyncIterator, Coroutine
 from itertools import islice
-from asyncio import ensure_future, sleep, run
+from collections import deque
+from time import monotonic
+from asyncio import ensure_future, sleep, run, wait, wait_for, gather, get_running_loop
+from asyncio import FIRST_COMPLETED
+from asyncio import TimeoutError as AsyncTimeoutError
 from aiohttp import ClientSession
 
 # Standard function type to parse the async responses
 ParseRequest = Callable[ClientSession, Any]
 
+# Coroutine functions run alongside the requests of every event loop, such as monitors.
+_loop_monitors: list[Callable[[], Coroutine]] = []
+# Slow callback threshold (seconds) of the event loops, None runs them without debug mode.
+_slow_callback_duration: Optional[float] = None
+
+
+def add_loop_monitor(monitor: Callable[[], Coroutine]) -> None:
+    _loop_monitors.append(monitor)
+
+
+def remove_loop_monitor(monitor: Callable[[], Coroutine]) -> None:
+    _loop_monitors.remove(monitor)
+
+
+def set_slow_callback_duration(duration: Optional[float]) -> None:
+    """
+    Runs the event loops in asyncio debug mode, reporting callbacks slower than duration seconds.
+    None disables debug mode.
+    """
+    global _slow_callback_duration  # pylint: disable=global-statement
+    _slow_callback_duration = duration
+
 
 class AsyncRequest:
     """
@@ -59,28 +85,113 @@ class AsyncRequest:
             response.raise_for_status()
             return await response.read()
 
+    async def stream(
+        self, session: ClientSession, chunk_size: int = 65536, **extra_data: Any
+    ) -> AsyncIterator[bytes]:
+        """
+        Sends a async request like send, but yields the response body in chunks
+        instead of buffering all of it. Raises if response status is bad.
+        """
+        async with session.request(**self.__data, **extra_data) as response:
+            response.raise_for_status()
+
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of request latencies (seconds) and answers percentile queries.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self.__samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self.__samples)
+
+    def record(self, latency: float) -> None:
+        self.__samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Returns the nearest-rank percentile of the recorded latencies, None if there are none.
+        """
+        if not self.__samples:
+            return None
+
+        ordered = sorted(self.__samples)
+        rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+        return ordered[rank]
+
+
+async def hedged_send(
+    request: AsyncRequest, session: ClientSession, hedge_after: Optional[float], **extra_data: Any
+) -> str:
+    """
+    Sends a request and, if no response has arrived after hedge_after seconds, sends a
+    duplicate of it. The first successful response wins and the other request is cancelled.
+    Raises the last error if both requests fail.
+    """
+    primary = ensure_future(request.send(session, **extra_data))
+
+    if hedge_after is None:
+        return await primary
+
+    pending = {primary}
+
+    # Cancels the requests still running if the caller is cancelled, e.g. by a deadline.
+    try:
+        done, pending = await wait(pending, timeout=hedge_after)
+
+        if done:
+            return primary.result()
+
+        pending.add(ensure_future(request.send(session, **extra_data)))
+
+        while True:
+            done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                if fut.exception() is None:
+                    return fut.result()
+
+            # Every request failed, re-raise the error of the last one.
+            if not pending:
+                return done.pop().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
 
 async def limited_as_completed(coros: Iterable[Any], limit: int) -> Iterable[Any]:
     """
     Runs a limited amount of coroutines at a time. Runs a new coroutine when one finishes.
+    Cancels the running coroutines if cancelled itself.
     """
     futures = [ensure_future(c) for c in islice(coros, 0, limit)]
     push_future = futures.append
     remove_future = futures.remove
 
-    while futures:
-        await sleep(0)
+    try:
+        while futures:
+            await sleep(0)
 
-        for fut in futures:
-            if fut.done():
-                remove_future(fut)
-                next_fut = next(coros, None)
+            for fut in futures:
+                if fut.done():
+                    remove_future(fut)
+                    next_fut = next(coros, None)
 
-                # If next returns the default value None, there is no more coroutines to run.
-                if next_fut is not None:
-                    push_future(ensure_future(next_fut))
+                    # If next returns the default value None, there is no more coroutines to run.
+                    if next_fut is not None:
+                        push_future(ensure_future(next_fut))
 
-                await fut
+                    await fut
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+        await gather(*futures, return_exceptions=True)
 
 
 def run_async_requests(
@@ -88,18 +199,53 @@ def run_async_requests(
     process_request: Union[ParseRequest, Iterable[ParseRequest]],
     base_url: Optional[str] = None,
     limit: int = 1000,
-) -> None:
+    deadline: Optional[float] = None,
+) -> bool:
     """
     Creates coroutines for all requests and runs them async.
+    If a deadline (seconds) is given, the requests still running when it is reached are
+    cancelled. Returns False if the deadline was reached, True otherwise.
     """
 
     async def launch():
+        if _slow_callback_duration is not None:
+            get_running_loop().slow_callback_duration = _slow_callback_duration
+
+        monitors = [ensure_future(monitor()) for monitor in _loop_monitors]
+
+        try:
+            return await launch_requests()
+        finally:
+            for monitor in monitors:
+                monitor.cancel()
+
+            await gather(*monitors, return_exceptions=True)
+
+    async def launch_requests():
         async with ClientSession(base_url=base_url) as session:
             if isinstance(process_request, Iterable):
                 coros = (proc(session, data) for proc, data in zip(process_request, requests_data))
             else:
                 coros = (process_request(session, data) for data in requests_data)
 
-            return await limited_as_completed(coros, limit)
+            try:
+                await wait_for(limited_as_completed(coros, limit), deadline)
+            except AsyncTimeoutError:
+                return False
+
+            return True
+
+    if deadline is not None and deadline <= 0:
+        return False
+
+    return run(launch(), debug=_slow_callback_duration is not None)
+
+
+def remaining_time(deadline: Optional[float]) -> Optional[float]:
+    """
+    Converts an absolute monotonic deadline into the seconds left until it, None if there is none.
+    """
+    if deadline is None:
+        return None
 
-    run(launch())
+    return deadline - monotonic()
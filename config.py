@@ -14,14 +14,23 @@ from utility import load_json
 IP_DB_NAME = ""
 IP_DB_PATH = ""
 IP_DB_EXPIRE_TIME = ""
+IP_DB_NEGATIVE_EXPIRE_TIME = ""
+IP_CACHE_SIZE = 0
+IP_INFO_BATCH = {}
+IP_REFRESH_BUDGET = None
 
 PROXY_DB_NAME = ""
 PROXY_DB_PATH = ""
 PROXY_DB_EXPIRE_TIME = ""
+PROXY_INDEX_PATH = ""
 
 DEFAULT_OUTFILE = ""
 DEFAULT_LOGGER = ""
 
+REQUEST_TIMEOUTS = {}
+HEDGE_PERCENTILE = 0
+RUN_DEADLINE = ""
+
 CONFIG_FILE_NAME = "config.json"
 
 
@@ -44,20 +53,33 @@ def init_config_vars():
             err_print(f"Could not load {CONFIG_FILE_NAME}\n{config_data}")
 
     # pylint: disable=global-statement
-    global IP_DB_NAME, IP_DB_PATH, IP_DB_EXPIRE_TIME
-    global PROXY_DB_NAME, PROXY_DB_PATH, PROXY_DB_EXPIRE_TIME
+    global IP_DB_NAME, IP_DB_PATH, IP_DB_EXPIRE_TIME, IP_DB_NEGATIVE_EXPIRE_TIME, IP_CACHE_SIZE
+    global IP_INFO_BATCH, IP_REFRESH_BUDGET
+    global PROXY_DB_NAME, PROXY_DB_PATH, PROXY_DB_EXPIRE_TIME, PROXY_INDEX_PATH
     global DEFAULT_LOGGER, DEFAULT_OUTFILE
+    global REQUEST_TIMEOUTS, HEDGE_PERCENTILE, RUN_DEADLINE
 
     IP_DB_NAME = get_setting(config_data, "ip_db_name")
     IP_DB_PATH = abspath(f"{IP_DB_NAME}")
     IP_DB_EXPIRE_TIME = timedelta(**get_setting(config_data, "ip_db_expire_time"))
+    IP_DB_NEGATIVE_EXPIRE_TIME = timedelta(
+        **get_setting(config_data, "ip_db_negative_expire_time")
+    )
+    IP_CACHE_SIZE = get_setting(config_data, "ip_cache_size")
+    IP_INFO_BATCH = get_setting(config_data, "ip_info_batch")
+    IP_REFRESH_BUDGET = get_setting(config_data, "ip_refresh_budget")
 
     PROXY_DB_NAME = get_setting(config_data, "proxy_db_name")
     PROXY_DB_PATH = abspath(f"{PROXY_DB_NAME}")
     PROXY_DB_EXPIRE_TIME = timedelta(**get_setting(config_data, "proxy_db_expire_time"))
+    PROXY_INDEX_PATH = abspath(get_setting(config_data, "proxy_index_name"))
 
     DEFAULT_OUTFILE = get_setting(config_data, "default_outfile_name")
     DEFAULT_LOGGER = get_setting(config_data, "default_logger_name")
 
+    REQUEST_TIMEOUTS = get_setting(config_data, "request_timeouts")
+    HEDGE_PERCENTILE = get_setting(config_data, "hedge_percentile")
+    RUN_DEADLINE = timedelta(**get_setting(config_data, "run_deadline"))
+
 
 init_config_vars()
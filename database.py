@@ -3,7 +3,7 @@
 *
 * SPDX-License-Identifier: BSD-2-Clause
 """
-from typing import Any
+from typing import Any, Iterable
 from datetime import datetime, timedelta
 from diskcache import Cache
 
@@ -14,6 +14,8 @@ class Database:
     """
 
     TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+    # Key of the write counter, a tuple so it never collides with the keys of entries.
+    GENERATION_KEY = ("generation",)
 
     def __init__(self, path: str) -> None:
         self.__database = Cache(path)
@@ -34,13 +36,19 @@ class Database:
         """
         Retrieve a list of all database keys.
         """
-        return list(self.__database)
+        return [key for key in self.__database if key != Database.GENERATION_KEY]
 
     def get_count(self):
         """
         Retrieve the number of keys in database.
         """
-        return len(self.__database)
+        return len(self.__database) - (Database.GENERATION_KEY in self.__database)
+
+    def get_generation(self) -> int:
+        """
+        Retrieve the write counter of the database, which changes whenever entries are stored.
+        """
+        return self.__database.get(Database.GENERATION_KEY, 0)
 
     def __contains__(self, key: Any) -> bool:
         """
@@ -56,15 +64,50 @@ class Database:
         Checks if an ip address entry has expired according to an expiry time.
         If it does not exist it is considered expired.
         """
-        if self.__contains__(key):
-            last_entry_time = datetime.strptime(self.get(key)["entry_time"], Database.TIME_FORMAT)
-            return (datetime.now() - last_entry_time) >= expire_time
+        return Database.entry_expired(self.get(key), expire_time)
+
+    @staticmethod
+    def entry_expired(entry: Any, expire_time: timedelta) -> bool:
+        """
+        Checks if an entry has expired according to an expiry time.
+        A missing entry (None) is considered expired.
+        """
+        if entry is None:
+            return True
 
-        return True
+        return Database.entry_age(entry) >= expire_time
+
+    @staticmethod
+    def entry_age(entry: Any) -> timedelta:
+        """
+        Retrieves the time since an entry was stored.
+        """
+        last_entry_time = datetime.strptime(entry["entry_time"], Database.TIME_FORMAT)
+        return datetime.now() - last_entry_time
+
+    @staticmethod
+    def stamp_entry(data: dict[Any, Any]) -> None:
+        """
+        Sets the entry time of data to the current time.
+        """
+        data["entry_time"] = datetime.now().strftime(Database.TIME_FORMAT)
 
     def store_entry(self, key: Any, data: dict[Any, Any]) -> None:
         """
         Stores an key with it's data and adds a timestamp
         """
-        data["entry_time"] = datetime.now().strftime(Database.TIME_FORMAT)
-        self.__database.set(key, data)
+        Database.stamp_entry(data)
+
+        with self.__database.transact():
+            self.__database.set(key, data)
+            self.__database.incr(Database.GENERATION_KEY)
+
+    def store_entries(self, entries: Iterable[tuple[Any, dict[Any, Any]]]) -> None:
+        """
+        Stores multiple keys with their data in a single transaction, keeping their timestamps.
+        """
+        with self.__database.transact():
+            for key, data in entries:
+                self.__database.set(key, data)
+
+            self.__database.incr(Database.GENERATION_KEY)
@@ -24,13 +24,16 @@ Json layout:
         'readme': 'https://ipinfo.io/missingauth'
     }
 """
-from typing import Iterable
+from typing import Iterable, Optional, Any, Callable, Awaitable
+from asyncio import Future, Task, TimerHandle, ensure_future, get_running_loop
+from collections import Counter, OrderedDict
 from json import loads
 from datetime import timedelta
 from aiohttp import ClientSession
 from asynchttprequest import AsyncRequest, run_async_requests, ParseRequest
 from database import Database
-from requestlogging import get_default_logger, log_request
+from asyncdatabase import AsyncDatabase
+from requestlogging import get_default_logger, log_request, log_cache_hit_rates
 from utility import extract_keys, str_join
 
 IP_INFO_RESPONSE_KEYS = (
@@ -44,52 +47,304 @@ IP_INFO_RESPONSE_KEYS = (
     "timezone",
 )
 
+# Function type fetching the ip info of an ip address.
+FetchIpInfo = Callable[[ClientSession, str], Awaitable[dict[str, str]]]
+
+# Key of negative entries, ip addresses ipinfo.io has no info for. The value is the reason.
+NEGATIVE_KEY = "negative"
+
+
+def parse_ip_info_response(ip_address: str, resp_json: Any) -> dict[str, str]:
+    """
+    Extracts the ip info from a ipinfo.io response of an ip address.
+    Returns a negative entry if ipinfo.io has no info for the ip address.
+    """
+    log = get_default_logger()
+
+    if not isinstance(resp_json, dict):
+        log.error("Unexpected response for ip address %s: %s", ip_address, resp_json)
+        return {NEGATIVE_KEY: "error"}
+
+    if "error" in resp_json:
+        log.error("Response contained error %s", resp_json["error"])
+        return {NEGATIVE_KEY: "error"}
+
+    if "bogon" in resp_json:
+        log.info("Bogon ip address, discarding response")
+        return {NEGATIVE_KEY: "bogon"}
+
+    ip_info = extract_keys(resp_json, IP_INFO_RESPONSE_KEYS)
+
+    if all(value is None for value in ip_info.values()):
+        log.info("No info for ip address %s, discarding response", ip_address)
+        return {NEGATIVE_KEY: "unresolvable"}
+
+    log.debug("Fetched ip info of ip address %s", ip_address)
+    return ip_info
+
 
 async def fetch_ip_info(session: ClientSession, ip_address: str) -> dict[str, str]:
     """
     Async fetch ip address data from ipinfo.io. Logs errors to logger.
+    Returns a negative entry if ipinfo.io has no info for the ip address,
+    and an empty dict if the request failed.
     """
-    log = get_default_logger()
     base_url = "https://ipinfo.io/"
     request = AsyncRequest(
         "GET", str_join(base_url, ip_address), headers={"Accept": "application/json"}
     )
 
-    response = await log_request(request, session)
+    response = await log_request(request, session, "ipinfo")
 
     if response is None:
         return {}
 
-    resp_json = loads(response)
+    return parse_ip_info_response(ip_address, loads(response))
 
-    if "error" in resp_json:
-        log.error("Response contained error %s", resp_json["error"])
-        return {}
 
-    if "bogon" in resp_json:
-        log.info("Bogon ip address, discarding response")
-        return {}
+class IpInfoBatcher:
+    """
+    Collects ip addresses to look up until batch_size of them are pending or linger seconds
+    have passed, and resolves them with a single POST to a batch endpoint such as
+    https://ipinfo.io/batch. Each caller of fetch gets the result of its ip address.
+    """
 
-    log.debug("Fetched ip info of ip address %s", ip_address)
-    return extract_keys(resp_json, IP_INFO_RESPONSE_KEYS)
+    def __init__(
+        self, batch_url: str, batch_size: int = 100, linger: float = 0.05, token: str = ""
+    ) -> None:
+        self.__batch_url = batch_url
+        self.__batch_size = batch_size
+        self.__linger = linger
+        self.__headers = {"Accept": "application/json"}
+
+        if token:
+            self.__headers["Authorization"] = f"Bearer {token}"
+
+        self.__loop = None
+        self.__session: Optional[ClientSession] = None
+        self.__pending: dict[str, list[Future]] = {}
+        self.__flush_timer: Optional[TimerHandle] = None
+        self.__batches: set[Task] = set()
+
+    async def fetch(self, session: ClientSession, ip_address: str) -> dict[str, str]:
+        """
+        Same as fetch_ip_info, but the ip address is looked up in the next batch.
+        """
+        loop = get_running_loop()
+
+        # Pending lookups of a previous event loop can never be resolved.
+        if loop is not self.__loop:
+            self.__loop = loop
+            self.__pending = {}
+            self.__flush_timer = None
+
+        self.__session = session
+        future = loop.create_future()
+        self.__pending.setdefault(ip_address, []).append(future)
+
+        if len(self.__pending) >= self.__batch_size:
+            self.__flush()
+        elif self.__flush_timer is None:
+            self.__flush_timer = loop.call_later(self.__linger, self.__flush)
+
+        return await future
+
+    def __flush(self) -> None:
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+
+        batch, self.__pending = self.__pending, {}
+        task = ensure_future(self.__send_batch(self.__session, batch))
+        # Keep a reference so the task is not garbage collected while running.
+        self.__batches.add(task)
+        task.add_done_callback(self.__batches.discard)
+
+    async def __send_batch(self, session: ClientSession, batch: dict[str, list[Future]]) -> None:
+        log = get_default_logger()
+        request = AsyncRequest("POST", self.__batch_url, headers=self.__headers, json=list(batch))
+        resp_json = {}
+
+        try:
+            response = await log_request(request, session, "ipinfo")
 
+            if response is None:
+                log.warning("Could not fetch ip info of %d ip addresses", len(batch))
+            else:
+                try:
+                    resp_json = loads(response)
+                except ValueError as e:
+                    log.error(
+                        "Invalid json in batch response for %d ip addresses: %s", len(batch), e
+                    )
 
-def create_ip_info_parser(ip_database: Database, expire_time: timedelta) -> ParseRequest:
-    async def parse_ip_info(session: ClientSession, ip_address: str) -> None:
-        if ip_database.key_expired(ip_address, expire_time):
-            ip_info = await fetch_ip_info(session, ip_address)
+                if not isinstance(resp_json, dict):
+                    log.error("Unexpected batch response for %d ip addresses", len(batch))
+                    resp_json = {}
+
+                log.debug("Fetched ip info of %d ip addresses in a batch", len(batch))
+
+        finally:
+            # Every waiting caller is resolved, also if the batch failed or was cancelled.
+            for ip_address, futures in batch.items():
+                # A failed batch is not cached, same as a failed single request.
+                ip_info = {}
+
+                if ip_address in resp_json:
+                    ip_info = parse_ip_info_response(ip_address, resp_json[ip_address])
+
+                for future in futures:
+                    if not future.done():
+                        future.set_result(ip_info)
+
+
+class IpInfoCache:
+    """
+    Two tier ip info cache: a bounded in-process LRU in front of the ip database.
+    Negative entries expire after their own, usually shorter, expire time.
+    Counts hits per tier and misses.
+    """
+
+    def __init__(
+        self,
+        ip_database: AsyncDatabase,
+        expire_time: timedelta,
+        negative_expire_time: Optional[timedelta] = None,
+        size: int = 10000,
+    ) -> None:
+        self.__database = ip_database
+        self.__expire_time = expire_time
+        # A negative entry never outlives a regular one, e.g. when updating all ip info.
+        self.__negative_expire_time = (
+            expire_time if negative_expire_time is None else min(negative_expire_time, expire_time)
+        )
+        self.__size = size
+        self.__entries: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self.stats = Counter()
+
+    async def get(self, ip_address: str, count: bool = True) -> Optional[dict[str, Any]]:
+        """
+        Retrieves the stored entry of an ip address, negative entries included.
+        Lookups made with count False are left out of the hit rate stats.
+        """
+        if ip_address in self.__entries:
+            self.__entries.move_to_end(ip_address)
+
+            if count:
+                self.stats["memory"] += 1
+
+            return self.__entries[ip_address]
+
+        entry = await self.__database.get(ip_address)
+
+        if count:
+            self.stats["miss" if entry is None else "disk"] += 1
+
+        if entry is not None:
+            self.__remember(ip_address, entry)
+
+        return entry
+
+    def entry_expire_time(self, entry: Optional[dict[str, Any]]) -> timedelta:
+        if entry is not None and NEGATIVE_KEY in entry:
+            return self.__negative_expire_time
+
+        return self.__expire_time
+
+    def entry_expired(self, entry: Optional[dict[str, Any]]) -> bool:
+        return Database.entry_expired(entry, self.entry_expire_time(entry))
+
+    def staleness(self, entry: Optional[dict[str, Any]]) -> Optional[float]:
+        """
+        Retrieves the age of an entry relative to its expire time, 1 when it just expired.
+        None if the entry is missing.
+        """
+        if entry is None:
+            return None
+
+        expire_seconds = max(self.entry_expire_time(entry).total_seconds(), 1)
+        return Database.entry_age(entry).total_seconds() / expire_seconds
+
+    async def store_entry(self, ip_address: str, entry: dict[str, Any]) -> None:
+        await self.__database.store_entry(ip_address, entry)
+        self.__remember(ip_address, entry)
+
+    def __remember(self, ip_address: str, entry: dict[str, Any]) -> None:
+        self.__entries[ip_address] = entry
+        self.__entries.move_to_end(ip_address)
+
+        if len(self.__entries) > self.__size:
+            self.__entries.popitem(last=False)
+
+
+def usable_ip_info(entry: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Retrieves the ip info of an ip info entry, an empty dict if it is missing or negative.
+    """
+    return {} if entry is None or NEGATIVE_KEY in entry else entry
+
+
+def create_ip_info_parser(
+    ip_cache: IpInfoCache,
+    entry_status: Optional[Counter] = None,
+    fetch: Optional[FetchIpInfo] = None,
+    refresh_allowed: Optional[Callable[[str], bool]] = None,
+) -> ParseRequest:
+    """
+    Creates a parser fetching and storing expired ip info, returning the current entry
+    of the ip address. Counts new, changed and unchanged entries in entry_status.
+    Fetches single ip addresses unless another fetch function, such as
+    IpInfoBatcher.fetch, is given. If refresh_allowed is given, only expired
+    ip addresses it accepts are fetched.
+    """
+    fetch = fetch_ip_info if fetch is None else fetch
+    entry_status = Counter() if entry_status is None else entry_status
+    compared_keys = (*IP_INFO_RESPONSE_KEYS, NEGATIVE_KEY)
+
+    async def parse_ip_info(session: ClientSession, ip_address: str) -> Optional[dict[str, Any]]:
+        prev_ip_info = await ip_cache.get(ip_address)
+
+        if ip_cache.entry_expired(prev_ip_info) and (
+            refresh_allowed is None or refresh_allowed(ip_address)
+        ):
+            ip_info = await fetch(session, ip_address)
 
             if ip_info:
-                ip_database.store_entry(ip_address, ip_info)
+                if prev_ip_info is None:
+                    entry_status["new"] += 1
+                elif extract_keys(prev_ip_info, compared_keys) == extract_keys(
+                    ip_info, compared_keys
+                ):
+                    entry_status["unchanged"] += 1
+                else:
+                    entry_status["changed"] += 1
+
+                # Always stored, the entry time marks when the ip info was last fetched.
+                await ip_cache.store_entry(ip_address, ip_info)
+                return ip_info
+
+        return prev_ip_info
 
     return parse_ip_info
 
 
 def ip_info(
-    ip_addresses: Iterable[str], ip_database: Database, expire_time: timedelta, limit: int
-) -> None:
-    run_async_requests(
-        ip_addresses,
-        create_ip_info_parser(ip_database, expire_time),
-        limit=limit,
-    )
+    ip_addresses: Iterable[str],
+    ip_database: Database,
+    expire_time: timedelta,
+    limit: int,
+    deadline: Optional[float] = None,
+    negative_expire_time: Optional[timedelta] = None,
+    batcher: Optional[IpInfoBatcher] = None,
+) -> bool:
+    with AsyncDatabase(ip_database) as async_ip_database:
+        ip_cache = IpInfoCache(async_ip_database, expire_time, negative_expire_time)
+        finished = run_async_requests(
+            ip_addresses,
+            create_ip_info_parser(ip_cache, fetch=None if batcher is None else batcher.fetch),
+            limit=limit,
+            deadline=deadline,
+        )
+
+    log_cache_hit_rates(ip_cache.stats, "ip info")
+    return finished
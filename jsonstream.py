@@ -0,0 +1,216 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Incremental parsing of a json array nested in a top level json object,
+such as the "data" array of a proxylist page.
+"""
+from typing import Any, Iterator, Optional
+from codecs import getincrementaldecoder
+from re import compile as re_compile
+from json import JSONDecoder
+
+WHITESPACE = " \t\n\r"
+# Default limit (characters) of a single buffered array item.
+MAX_ITEM_SIZE = 1 << 20
+
+STRING_PATTERN = re_compile(r'"(?:[^"\\]|\\.)*"')
+CONTAINER_TOKEN_PATTERN = re_compile(r'["{}\[\]]')
+SCALAR_END_PATTERN = re_compile(r"[\s,\]}]")
+
+# States while parsing the array.
+_ARRAY_START = 0
+_AFTER_ITEM = 1
+_AFTER_SEPARATOR = 2
+
+
+def find_item_end(buffer: str, pos: int) -> Optional[int]:
+    """
+    Finds the end of the json value starting at pos, None if it does not end within buffer.
+    Only looks at the value boundaries, the value itself might still be invalid.
+    """
+    char = buffer[pos]
+
+    if char == '"':
+        match = STRING_PATTERN.match(buffer, pos)
+        return None if match is None else match.end()
+
+    # Scalars end at the first delimiter, the next chunk might continue them otherwise.
+    if char not in "{[":
+        match = SCALAR_END_PATTERN.search(buffer, pos)
+        return None if match is None else match.start()
+
+    depth = 0
+
+    while True:
+        match = CONTAINER_TOKEN_PATTERN.search(buffer, pos)
+
+        if match is None:
+            return None
+
+        token = match.group()
+
+        if token == '"':
+            string_end = find_item_end(buffer, match.start())
+
+            if string_end is None:
+                return None
+
+            pos = string_end
+            continue
+
+        depth += 1 if token in "{[" else -1
+        pos = match.end()
+
+        if depth == 0:
+            return pos
+
+
+class JsonArrayStream:
+    """
+    Feeds chunks of a json document and yields the items of the array stored under
+    a top level key one by one, only buffering the item currently being parsed.
+    """
+
+    def __init__(self, key: str, max_item_size: int = MAX_ITEM_SIZE) -> None:
+        self.__key = key
+        self.__max_item_size = max_item_size
+        self.__decoder = JSONDecoder()
+        self.__text_decoder = getincrementaldecoder("utf-8")()
+        self.__buffer = ""
+        self.__in_array = False
+        self.__array_state = _ARRAY_START
+        self.__done = False
+
+        # State used while searching for the key in the top level object.
+        self.__depth = 0
+        self.__in_string = False
+        self.__escaped = False
+        self.__string_start = 0
+        # Position in the buffer where scanning continues with the next chunk.
+        self.__scan_pos = 0
+        self.__last_key = None
+        self.__expect_array = False
+
+    @property
+    def done(self) -> bool:
+        """
+        True when the end of the array has been parsed.
+        """
+        return self.__done
+
+    def feed(self, chunk: bytes) -> Iterator[Any]:
+        """
+        Adds a chunk of the document and yields every array item completed by it.
+        Raises ValueError if the array is not valid json or an item exceeds the max item size.
+        """
+        if self.__done:
+            return
+
+        self.__buffer += self.__text_decoder.decode(chunk)
+
+        if not self.__in_array and not self.__seek_array():
+            return
+
+        yield from self.__parse_items()
+
+    def __seek_array(self) -> bool:
+        """
+        Scans the buffer for the array under the key. Returns True when the array was found.
+        """
+        buffer = self.__buffer
+
+        for pos in range(self.__scan_pos, len(buffer)):
+            char = buffer[pos]
+
+            if self.__in_string:
+                if self.__escaped:
+                    self.__escaped = False
+                elif char == "\\":
+                    self.__escaped = True
+                elif char == '"':
+                    self.__in_string = False
+
+                    if self.__depth == 1:
+                        self.__last_key = buffer[self.__string_start : pos]
+
+                continue
+
+            if self.__expect_array and char not in WHITESPACE:
+                self.__expect_array = False
+
+                if char == "[":
+                    self.__in_array = True
+                    self.__buffer = buffer[pos + 1 :]
+                    return True
+
+            if char == '"':
+                self.__in_string = True
+                self.__string_start = pos + 1
+
+            elif char == ":" and self.__depth == 1 and self.__last_key == self.__key:
+                self.__expect_array = True
+
+            elif char in "{[":
+                self.__depth += 1
+
+            elif char in "}]":
+                self.__depth -= 1
+
+            elif char == ",":
+                self.__last_key = None
+
+        # Keep the unfinished string so the key can still be extracted from it,
+        # scanning continues after it since the string state is kept as well.
+        keep_from = self.__string_start if self.__in_string else len(buffer)
+        self.__string_start -= keep_from
+        self.__scan_pos = len(buffer) - keep_from
+        self.__buffer = buffer[keep_from:]
+        return False
+
+    def __parse_items(self) -> Iterator[Any]:
+        buffer = self.__buffer
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+
+            if self.__array_state != _AFTER_SEPARATOR and char == "]":
+                self.__done = True
+                pos += 1
+                break
+
+            if self.__array_state == _AFTER_ITEM:
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' after json array item, got {char!r}")
+
+                self.__array_state = _AFTER_SEPARATOR
+                pos += 1
+                continue
+
+            end = find_item_end(buffer, pos)
+
+            # The item is not complete yet, wait for more data.
+            if end is None:
+                if len(buffer) - pos > self.__max_item_size:
+                    raise ValueError(f"Json array item larger than {self.__max_item_size} chars")
+
+                break
+
+            item, item_end = self.__decoder.raw_decode(buffer, pos)
+
+            if item_end != end:
+                raise ValueError(f"Invalid json array item {buffer[pos:end]!r}")
+
+            pos = end
+            self.__array_state = _AFTER_ITEM
+            yield item
+
+        self.__buffer = buffer[pos:]
@@ -0,0 +1,147 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Profiling of a scrape: a CPU profile of the main thread, an event loop lag
+sampler and optionally asyncio debug slow callback reports.
+"""
+from typing import Optional, IO
+from io import StringIO
+from cProfile import Profile
+from pstats import Stats, SortKey
+from bisect import bisect_left
+from asyncio import get_running_loop, sleep
+from logging import Handler, LogRecord, getLogger
+from asynchttprequest import add_loop_monitor, remove_loop_monitor, set_slow_callback_duration
+
+# Upper bounds (ms) of the lag histogram buckets, the last bucket holds everything above.
+LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class LoopLagSampler:
+    """
+    Schedules a callback every interval seconds and records how late it fires.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.__interval = interval
+        self.__buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.__max_lag = 0.0
+        self.__total_lag = 0.0
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.__buckets)
+
+    async def run(self) -> None:
+        loop = get_running_loop()
+
+        while True:
+            start_time = loop.time()
+            await sleep(self.__interval)
+            self.record(max(0.0, loop.time() - start_time - self.__interval))
+
+    def record(self, lag: float) -> None:
+        self.__buckets[bisect_left(LAG_BUCKETS_MS, lag * 1000)] += 1
+        self.__max_lag = max(self.__max_lag, lag)
+        self.__total_lag += lag
+
+    def write_histogram(self, stream: IO) -> None:
+        count = self.sample_count
+
+        if count == 0:
+            stream.write("No event loop lag samples\n")
+            return
+
+        stream.write(
+            f"Event loop lag: {count} samples, mean {self.__total_lag / count * 1000:.2f} ms, "
+            f"max {self.__max_lag * 1000:.2f} ms\n"
+        )
+
+        lower_bound = 0
+        for upper_bound, bucket_count in zip((*LAG_BUCKETS_MS, None), self.__buckets):
+            label = f"> {lower_bound} ms" if upper_bound is None else f"<= {upper_bound} ms"
+            bar = "#" * round(50 * bucket_count / count)
+            stream.write(f"{label:>12} {bucket_count:>8} {bar}\n")
+            lower_bound = upper_bound
+
+
+class SlowCallbackHandler(Handler):
+    """
+    Collects the asyncio debug mode reports of slow callbacks.
+    """
+
+    def __init__(self, max_reports: int = 1000) -> None:
+        super().__init__()
+        self.__max_reports = max_reports
+        self.reports: list[tuple[float, str]] = []
+
+    def emit(self, record: LogRecord) -> None:
+        # Asyncio logs slow callbacks as "Executing %s took %.3f seconds".
+        if not record.msg.startswith("Executing") or len(record.args) != 2:
+            return
+
+        if len(self.reports) < self.__max_reports:
+            handle, duration = record.args
+            self.reports.append((duration, str(handle)))
+
+
+class RunProfiler:
+    """
+    Profiles everything run inside its context and writes a summary report.
+    """
+
+    def __init__(self, slow_callback_duration: Optional[float] = None) -> None:
+        self.__profile = Profile()
+        self.__lag_sampler = LoopLagSampler()
+        self.__slow_callback_duration = slow_callback_duration
+        self.__slow_callbacks = SlowCallbackHandler()
+
+    def __enter__(self):
+        add_loop_monitor(self.__lag_sampler.run)
+
+        if self.__slow_callback_duration is not None:
+            set_slow_callback_duration(self.__slow_callback_duration)
+            getLogger("asyncio").addHandler(self.__slow_callbacks)
+
+        self.__profile.enable()
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.__profile.disable()
+        remove_loop_monitor(self.__lag_sampler.run)
+
+        if self.__slow_callback_duration is not None:
+            set_slow_callback_duration(None)
+            getLogger("asyncio").removeHandler(self.__slow_callbacks)
+
+    def dump_stats(self, path: str) -> None:
+        """
+        Writes the raw CPU profile, readable with pstats or snakeviz.
+        """
+        self.__profile.dump_stats(path)
+
+    def write_report(self, path: str, top_count: int = 30) -> None:
+        """
+        Writes the hottest functions, the event loop lag histogram and the slowest callbacks.
+        """
+        stats_stream = StringIO()
+        stats = Stats(self.__profile, stream=stats_stream)
+        stats.sort_stats(SortKey.TIME).print_stats(top_count)
+
+        with open(path, "w", encoding="utf-8") as report:
+            report.write(f"Top {top_count} functions by own time (main thread)\n")
+            report.write(stats_stream.getvalue())
+            report.write("\n")
+            self.__lag_sampler.write_histogram(report)
+
+            if self.__slow_callback_duration is not None:
+                slowest = sorted(self.__slow_callbacks.reports, reverse=True)[:top_count]
+                report.write(
+                    f"\n{len(self.__slow_callbacks.reports)} callbacks slower than "
+                    f"{self.__slow_callback_duration * 1000:.0f} ms\n"
+                )
+
+                for duration, handle in slowest:
+                    report.write(f"{duration * 1000:>10.1f} ms {handle}\n")
@@ -0,0 +1,216 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Index over the proxy database for CIDR, ASN and country queries.
+
+Ip addresses are indexed as integers in a sorted list, so all proxies in a
+network are found with two binary searches. ASN and country are indexed
+with inverted indexes mapping a value to the proxy keys having it.
+"""
+from typing import Any, Iterable, Optional
+from bisect import bisect_left, insort
+from re import compile as re_compile
+from ipaddress import ip_network
+from database import Database
+from requestlogging import get_default_logger
+from utility import ip_to_int, try_get_key
+
+ASN_PATTERN = re_compile(r"AS(\d+)")
+
+# Key of the index in the index database.
+PROXY_INDEX_KEY = "proxy_index"
+# Version of the stored index data, an index stored with another version is rebuilt.
+PROXY_INDEX_VERSION = 1
+
+
+def parse_asns(org: Optional[str]) -> set[int]:
+    """
+    Extracts all ASN numbers from an org string such as "AS123 Some Org;AS123".
+    """
+    if not org:
+        return set()
+
+    return {int(asn) for asn in ASN_PATTERN.findall(org)}
+
+
+class ProxyIndex:
+    """
+    Sorted integer ip index and inverted ASN and country indexes of proxy keys ("ip:port").
+    """
+
+    def __init__(self) -> None:
+        # Sorted (ip version, ip as integer, proxy key) tuples.
+        self.__ips: list[tuple[int, int, str]] = []
+        # Proxy key to the indexed (country, asns), used to update changed entries.
+        self.__fields: dict[str, tuple[Optional[str], frozenset[int]]] = {}
+        self.__countries: dict[str, set[str]] = {}
+        self.__asns: dict[int, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__fields)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__fields
+
+    @classmethod
+    def build(cls, proxy_db: Database) -> "ProxyIndex":
+        """
+        Creates an index of every entry in a proxy database.
+        """
+        index = cls()
+
+        for key in proxy_db.get_entries():
+            index.add(key, proxy_db.get(key))
+
+        return index
+
+    def to_data(self) -> dict[str, Any]:
+        """
+        Converts the index to plain lists and dicts for storing.
+        """
+        return {
+            "ips": self.__ips,
+            "fields": {
+                key: (country, sorted(asns)) for key, (country, asns) in self.__fields.items()
+            },
+        }
+
+    @classmethod
+    def from_data(cls, data: dict[str, Any]) -> "ProxyIndex":
+        """
+        Recreates an index from the data of to_data.
+        """
+        index = cls()
+        index.__ips = [tuple(ip) for ip in data["ips"]]
+
+        for key, (country, asns) in data["fields"].items():
+            index.__set_fields(key, country, frozenset(asns))
+
+        return index
+
+    def add(self, key: str, entry: dict[str, Any]) -> None:
+        """
+        Indexes a proxy entry, replacing the previously indexed fields of the key.
+        """
+        country = try_get_key("country", entry)
+        asns = frozenset(parse_asns(try_get_key("org", entry)))
+
+        if key in self.__fields:
+            prev_country, prev_asns = self.__fields[key]
+
+            if (prev_country, prev_asns) == (country, asns):
+                return
+
+            self.__discard_fields(key, prev_country, prev_asns)
+        else:
+            ip_address = key.rsplit(":", 1)[0]
+            insort(self.__ips, (*ip_to_int(ip_address), key))
+
+        self.__set_fields(key, country, asns)
+
+    def __set_fields(self, key: str, country: Optional[str], asns: frozenset[int]) -> None:
+        self.__fields[key] = (country, asns)
+
+        if country is not None:
+            self.__countries.setdefault(country, set()).add(key)
+
+        for asn in asns:
+            self.__asns.setdefault(asn, set()).add(key)
+
+    def __discard_fields(self, key: str, country: Optional[str], asns: Iterable[int]) -> None:
+        if country is not None:
+            self.__countries[country].discard(key)
+
+        for asn in asns:
+            self.__asns[asn].discard(key)
+
+    def in_network(self, cidr: str) -> set[str]:
+        """
+        Retrieves the keys of all proxies with an ip address in a network, such as "1.2.0.0/16".
+        """
+        network = ip_network(cidr, strict=False)
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        start = bisect_left(self.__ips, (network.version, first))
+        end = bisect_left(self.__ips, (network.version, last + 1))
+
+        return {key for _, _, key in self.__ips[start:end]}
+
+    def in_countries(self, countries: Iterable[str]) -> set[str]:
+        return set().union(*(self.__countries.get(country, ()) for country in countries))
+
+    def in_asns(self, asns: Iterable[int]) -> set[str]:
+        return set().union(*(self.__asns.get(asn, ()) for asn in asns))
+
+    def query(
+        self,
+        cidrs: Optional[Iterable[str]] = None,
+        exclude_cidrs: Optional[Iterable[str]] = None,
+        asns: Optional[Iterable[int]] = None,
+        countries: Optional[Iterable[str]] = None,
+        exclude_countries: Optional[Iterable[str]] = None,
+    ) -> set[str]:
+        """
+        Retrieves the keys of all proxies matching every given filter.
+        Filters given as None are not applied.
+        """
+        keys = set(self.__fields)
+
+        if cidrs is not None:
+            keys &= set().union(*(self.in_network(cidr) for cidr in cidrs))
+
+        if exclude_cidrs is not None:
+            keys -= set().union(*(self.in_network(cidr) for cidr in exclude_cidrs))
+
+        if asns is not None:
+            keys &= self.in_asns(asns)
+
+        if countries is not None:
+            keys &= self.in_countries(countries)
+
+        if exclude_countries is not None:
+            keys -= self.in_countries(exclude_countries)
+
+        return keys
+
+
+def load_proxy_index(index_db: Database, proxy_db: Database) -> ProxyIndex:
+    """
+    Loads the stored proxy index. Rebuilds and stores it if it is missing, unreadable or out
+    of sync with the database, i.e. the database was written after the index was stored.
+    """
+    log = get_default_logger()
+
+    try:
+        stored = index_db.get(PROXY_INDEX_KEY)
+
+        if (
+            stored is not None
+            and stored["version"] == PROXY_INDEX_VERSION
+            and stored["generation"] == proxy_db.get_generation()
+        ):
+            return ProxyIndex.from_data(stored["index"])
+
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("Could not load proxy index, rebuilding it: %s", e)
+
+    log.info("Building proxy index")
+    index = ProxyIndex.build(proxy_db)
+    save_proxy_index(index_db, index, proxy_db)
+    return index
+
+
+def save_proxy_index(index_db: Database, index: ProxyIndex, proxy_db: Database) -> None:
+    """
+    Stores the index together with the generation of the database it is in sync with.
+    """
+    index_db.store_entry(
+        PROXY_INDEX_KEY,
+        {
+            "version": PROXY_INDEX_VERSION,
+            "generation": proxy_db.get_generation(),
+            "index": index.to_data(),
+        },
+    )
@@ -5,20 +5,51 @@
 * SPDX-License-Identifier: BSD-2-Clause
 """
 from typing import Any
-from argparse import ArgumentParser
+from argparse import ArgumentParser, BooleanOptionalAction
 from sys import argv, stderr
 from json import dump
 from datetime import timedelta
+from ipaddress import ip_network
+from os.path import splitext
 from logging import DEBUG, INFO, WARNING
 from scraper import proxy_scraper
-from requestlogging import init_logger
+from ipinfo import IpInfoBatcher
+from requestlogging import init_logger, set_hedge_percentile, get_default_logger
 from database import Database
+from profiling import RunProfiler
+from snapshot import write_snapshot
+from utility import try_get_key
+from proxyindex import load_proxy_index, save_proxy_index
 from config import (
     DEFAULT_OUTFILE,
     IP_DB_PATH,
     IP_DB_EXPIRE_TIME,
+    IP_DB_NEGATIVE_EXPIRE_TIME,
+    IP_CACHE_SIZE,
+    IP_INFO_BATCH,
+    IP_REFRESH_BUDGET,
     PROXY_DB_PATH,
     PROXY_DB_EXPIRE_TIME,
+    PROXY_INDEX_PATH,
+    CONFIG_FILE_NAME,
+    HEDGE_PERCENTILE,
+    RUN_DEADLINE,
+)
+
+
+# Arguments filtering the json output, which the snapshot does not apply.
+EXPORT_FILTER_ARGS = (
+    ("--google",),
+    ("--anon",),
+    ("--speed",),
+    ("--min-score",),
+    ("--sort",),
+    ("--protocols",),
+    ("--cidr",),
+    ("--exclude-cidr",),
+    ("--asn",),
+    ("--country",),
+    ("--exclude-country",),
 )
 
 
@@ -36,6 +67,30 @@ def init_args(raw_args):
 
         return check_value
 
+    def fraction(value: Any):
+        fvalue = float(value)
+
+        if fvalue > 1 or fvalue < 0:
+            parser.error(f"{value} is invalid, must be 0 <= value <= 1")
+
+        return fvalue
+
+    def network(value: str) -> str:
+        try:
+            ip_network(value, strict=False)
+        except ValueError:
+            parser.error(f"{value} is not a valid CIDR network")
+
+        return value
+
+    def asn(value: str) -> int:
+        number = value.upper().removeprefix("AS")
+
+        if not number.isdigit():
+            parser.error(f"{value} is not a valid ASN")
+
+        return int(number)
+
     # Add functionality to extract proxies, filter after google accepted, fail rate, maximum response time and anonymity level.
 
     argument_definitions = {
@@ -66,6 +121,52 @@ def init_args(raw_args):
             "default": 500,
             "help": "Max number of requests to run asynchronous (default 100, more than 1000 is not recommended).",
         },
+        ("--hedge",): {
+            "dest": "hedge",
+            "action": "store_true",
+            "help": "Send a duplicate of requests slower than the hedge percentile latency "
+            "of their stage, first response wins.",
+        },
+        ("--hedge-percentile",): {
+            "dest": "hedge_percentile",
+            "type": integer_in_range(1, 99),
+            "default": None,
+            "help": "Latency percentile after which requests are hedged, implies --hedge "
+            f"(default {HEDGE_PERCENTILE}).",
+        },
+        ("--deadline",): {
+            "dest": "deadline",
+            "type": integer_in_range(1, 86400),
+            "default": int(RUN_DEADLINE.total_seconds()),
+            "help": "Deadline (s) of a scrape, partial results are kept when it is reached "
+            f"(default {int(RUN_DEADLINE.total_seconds())}).",
+        },
+        ("--page-size",): {
+            "dest": "page_size",
+            "type": integer_in_range(1, 10000),
+            "default": 100,
+            "help": "Number of proxies to request per proxylist page (default 100).",
+        },
+        ("--stream",): {
+            "dest": "stream",
+            "action": "store_true",
+            "help": "Parse proxylist pages incrementally while they are received, "
+            "recommended for large page sizes.",
+        },
+        ("--ip-batch",): {
+            "dest": "ip_batch",
+            "action": BooleanOptionalAction,
+            "default": IP_INFO_BATCH["enabled"],
+            "help": "Look up ip info in batches with the batch endpoint in "
+            f"{CONFIG_FILE_NAME} (default {IP_INFO_BATCH['enabled']}).",
+        },
+        ("--ip-budget",): {
+            "dest": "ip_budget",
+            "type": integer_in_range(0, 1000000),
+            "default": IP_REFRESH_BUDGET,
+            "help": "Max number of stale ip addresses to refresh, the most valuable first "
+            f"(default {'unlimited' if IP_REFRESH_BUDGET is None else IP_REFRESH_BUDGET}).",
+        },
         ("--google",): {
             "dest": "google",
             "action": "store_true",
@@ -84,6 +185,18 @@ def init_args(raw_args):
             "default": 1000,
             "help": "Specify maximal response time (ms) of proxy server ",
         },
+        ("--min-score",): {
+            "dest": "min_score",
+            "type": fraction,
+            "default": 0,
+            "help": "Specify a minimum quality score (0-1) from the proxy history (default 0).",
+        },
+        ("--sort",): {
+            "dest": "sort",
+            "choices": ("score", "stability", "speed"),
+            "default": None,
+            "help": "Order the output by best quality score, stability or speed.",
+        },
         # Can specify multiple protocols.
         ("--protocols",): {
             "dest": "protocols",
@@ -93,6 +206,67 @@ def init_args(raw_args):
             "action": "extend",
             "help": "Specify what protocol(s) the proxy should have",
         },
+        # Can specify multiple networks, asns and countries.
+        ("--cidr",): {
+            "dest": "cidrs",
+            "nargs": "+",
+            "type": network,
+            "default": None,
+            "action": "extend",
+            "help": "Only output proxies inside the given network(s), e.g. 1.2.0.0/16.",
+        },
+        ("--exclude-cidr",): {
+            "dest": "exclude_cidrs",
+            "nargs": "+",
+            "type": network,
+            "default": None,
+            "action": "extend",
+            "help": "Do not output proxies inside the given network(s).",
+        },
+        ("--asn",): {
+            "dest": "asns",
+            "nargs": "+",
+            "type": asn,
+            "default": None,
+            "action": "extend",
+            "help": "Only output proxies in the given ASN(s), e.g. AS13335 or 13335.",
+        },
+        ("--country",): {
+            "dest": "countries",
+            "nargs": "+",
+            "type": str.upper,
+            "default": None,
+            "action": "extend",
+            "help": "Only output proxies in the given country code(s), e.g. SE.",
+        },
+        ("--exclude-country",): {
+            "dest": "exclude_countries",
+            "nargs": "+",
+            "type": str.upper,
+            "default": None,
+            "action": "extend",
+            "help": "Do not output proxies in the given country code(s).",
+        },
+        ("--snapshot",): {
+            "dest": "snapshot",
+            "action": "store_true",
+            "help": "Write the whole cache as a columnar, memory mappable snapshot directory "
+            "next to the output file instead of a json file. Cannot be combined with the "
+            "output filters, the snapshot is filtered when read.",
+        },
+        ("--profile",): {
+            "dest": "profile",
+            "action": "store_true",
+            "help": "Profile the run and write a report of the hottest functions and the event "
+            "loop lag next to the output file.",
+        },
+        ("--slow-callback",): {
+            "dest": "slow_callback",
+            "type": integer_in_range(1, 10000),
+            "default": None,
+            "help": "With --profile, run asyncio in debug mode and report callbacks slower "
+            "than the given time (ms).",
+        },
         # Counts the amount of v specified.
         # 1 v means that INFO messages will be logged, 2 v means also DEBUG messages will be logged.
         ("-v", "--verbose"): {
@@ -105,7 +279,32 @@ def init_args(raw_args):
     for arg, settings in argument_definitions.items():
         parser.add_argument(*arg, **settings)
 
-    return parser.parse_args(raw_args)
+    args = parser.parse_args(raw_args)
+
+    if args.slow_callback is not None and not args.profile:
+        parser.error("--slow-callback requires --profile")
+
+    # The snapshot holds every proxy of the cache, filters are applied when reading it.
+    if args.snapshot:
+        export_filters = [
+            arg[0]
+            for arg in EXPORT_FILTER_ARGS
+            if getattr(args, argument_definitions[arg]["dest"])
+            != parser.get_default(argument_definitions[arg]["dest"])
+        ]
+
+        if export_filters:
+            parser.error(f"--snapshot cannot be combined with {', '.join(export_filters)}")
+
+    return args
+
+
+# Sort keys of the output entries, best first. Entries missing the value are placed last.
+SORT_KEYS = {
+    "score": lambda item: -(try_get_key("score", item[1]) or 0),
+    "stability": lambda item: -(try_get_key("stability", item[1]) or 0),
+    "speed": lambda item: (item[1]["speed"] is None, item[1]["speed"] or 0),
+}
 
 
 def get_verbosity(verbose_count: int) -> int:
@@ -122,31 +321,96 @@ def main(args):
     # Switch to INFO to remove debug messages.
 
     init_logger(get_verbosity(args.verbose), stderr)
+    hedge_percentile = args.hedge_percentile
+
+    if hedge_percentile is None and args.hedge:
+        hedge_percentile = HEDGE_PERCENTILE
+
+    set_hedge_percentile(hedge_percentile)
+
+    if not args.profile:
+        scrape_and_export(args)
+        return
+
+    slow_callback = None if args.slow_callback is None else args.slow_callback / 1000
+
+    with RunProfiler(slow_callback) as profiler:
+        scrape_and_export(args)
+
+    # Reports are written next to the output file, e.g. proxyscraper.profile.txt.
+    output_base = splitext(args.output)[0]
+    profiler.dump_stats(f"{output_base}.prof")
+    profiler.write_report(f"{output_base}.profile.txt")
+
+
+def scrape_and_export(args):
     proxy_db_expire_time = PROXY_DB_EXPIRE_TIME
     ip_db_expire_time = IP_DB_EXPIRE_TIME
 
-    with Database(IP_DB_PATH) as ip_database, Database(PROXY_DB_PATH) as proxy_database:
+    with Database(IP_DB_PATH) as ip_database, Database(
+        PROXY_DB_PATH
+    ) as proxy_database, Database(PROXY_INDEX_PATH) as index_database:
+        proxy_index = load_proxy_index(index_database, proxy_database)
+
         if args.update or args.only_update:
             if args.ip_update:
                 ip_db_expire_time = timedelta(0)
 
             proxy_db_expire_time = timedelta(0)
+            ip_batcher = None
+
+            if args.ip_batch:
+                ip_batcher = IpInfoBatcher(
+                    IP_INFO_BATCH["url"],
+                    IP_INFO_BATCH["size"],
+                    IP_INFO_BATCH["linger_ms"] / 1000,
+                    IP_INFO_BATCH["token"],
+                )
+
             proxy_scraper(
                 proxy_database,
                 ip_database,
                 proxy_db_expire_time,
                 ip_db_expire_time,
                 args.batch_size,
+                run_deadline=timedelta(seconds=args.deadline),
+                page_limit=args.page_size,
+                stream=args.stream,
+                proxy_index=proxy_index,
+                ip_negative_expire_time=IP_DB_NEGATIVE_EXPIRE_TIME,
+                ip_cache_size=IP_CACHE_SIZE,
+                ip_batcher=ip_batcher,
+                ip_refresh_budget=args.ip_budget,
             )
+            save_proxy_index(index_database, proxy_index, proxy_database)
+
+        if args.snapshot and not args.only_update:
+            snapshot_path = f"{splitext(args.output)[0]}.snapshot"
+            row_count = write_snapshot(proxy_database, snapshot_path)
+            get_default_logger().info("Wrote %d proxies to snapshot %s", row_count, snapshot_path)
 
-        if not args.only_update:
+        elif not args.only_update:
             with open(args.output, "w", encoding="utf-8") as json_file:
-                entries = proxy_database.get_entries()
+                matching_entries = proxy_index.query(
+                    args.cidrs,
+                    args.exclude_cidrs,
+                    args.asns,
+                    args.countries,
+                    args.exclude_countries,
+                )
                 json_data = {}
 
-                for entry in entries:
+                # Database order, the query result is a set and its order varies between runs.
+                for entry in proxy_database.get_entries():
+                    if entry not in matching_entries:
+                        continue
+
                     proxy_data = proxy_database.get(entry)
 
+                    # The entry was removed from the database after it was indexed.
+                    if proxy_data is None:
+                        continue
+
                     # If google accepted proxy is specified and the proxy is not google accepted.
                     if args.google and not proxy_data["google"]:
                         continue
@@ -162,6 +426,10 @@ def main(args):
                     if proxy_data["speed"] > args.speed:
                         continue
 
+                    # If the proxy quality score is lower than specified.
+                    if (try_get_key("score", proxy_data) or 0) < args.min_score:
+                        continue
+
                     # If anonymous anonymity was specified and proxy does not have higher or equal.
                     if (
                         args.anonymity == "anonymous"
@@ -176,7 +444,13 @@ def main(args):
                     ):
                         continue
 
-                    json_data[entry] = proxy_data
+                    # The history is internal to the cache and not json serializable.
+                    json_data[entry] = {
+                        key: value for key, value in proxy_data.items() if key != "history"
+                    }
+
+                if args.sort is not None:
+                    json_data = dict(sorted(json_data.items(), key=SORT_KEYS[args.sort]))
 
                 dump(json_data, json_file)
 
@@ -0,0 +1,170 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Quality history of a proxy across refreshes.
+
+Each refresh adds an observation of the proxy's speed, latency, upTime and
+responseTime to a fixed-size ring buffer, and updates exponentially weighted
+moving averages from which a quality score and a stability measure are derived.
+"""
+from typing import Any, Optional
+from array import array
+from math import isnan, nan, sqrt
+from time import time
+from utility import try_get_key
+
+# Observed proxy entry fields, in the order they are stored per observation.
+OBSERVED_KEYS = ("speed", "latency", "upTime", "responseTime")
+# Number of observations kept per proxy.
+HISTORY_SIZE = 16
+# Weight of the newest observation in the moving averages.
+EWMA_ALPHA = 0.3
+# Latency (ms) at which the latency factor of the score is halved.
+LATENCY_SCALE_MS = 1000
+
+_FIELDS_PER_OBSERVATION = 1 + len(OBSERVED_KEYS)
+
+
+def to_float(value: Any) -> float:
+    """
+    Converts a proxy entry value to float, nan if it is missing or not a number.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return nan
+
+
+class QualityHistory:
+    """
+    Ring buffer of the latest proxy observations with incrementally updated
+    moving averages. Adding an observation is O(1) and the storage is bounded.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self.__size = size
+        # Observation i is stored as (timestamp, *OBSERVED_KEYS) at i * _FIELDS_PER_OBSERVATION.
+        self.__observations = array("d", [nan]) * (size * _FIELDS_PER_OBSERVATION)
+        self.__next = 0
+        self.__count = 0
+        self.__uptime_mean = nan
+        self.__latency_mean = nan
+        self.__latency_variance = 0.0
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def to_data(self) -> dict[str, Any]:
+        """
+        Converts the history to plain data for storing, the ring buffer as raw doubles.
+        """
+        return {
+            "size": self.__size,
+            "observations": self.__observations.tobytes(),
+            "next": self.__next,
+            "count": self.__count,
+            "uptime_mean": self.__uptime_mean,
+            "latency_mean": self.__latency_mean,
+            "latency_variance": self.__latency_variance,
+        }
+
+    @classmethod
+    def from_data(cls, data: dict[str, Any]) -> "QualityHistory":
+        """
+        Recreates a history from the data of to_data.
+        """
+        history = cls(data["size"])
+        observations = array("d")
+        observations.frombytes(data["observations"])
+
+        if len(observations) != len(history.__observations):
+            raise ValueError(f"Quality history data has {len(observations)} values")
+
+        history.__observations = observations
+        history.__next = data["next"]
+        history.__count = data["count"]
+        history.__uptime_mean = data["uptime_mean"]
+        history.__latency_mean = data["latency_mean"]
+        history.__latency_variance = data["latency_variance"]
+        return history
+
+    def add(self, entry: dict[str, Any], timestamp: Optional[float] = None) -> None:
+        """
+        Adds the observed fields of a proxy entry, overwriting the oldest observation if full.
+        """
+        values = [to_float(try_get_key(key, entry)) for key in OBSERVED_KEYS]
+        start = self.__next * _FIELDS_PER_OBSERVATION
+        self.__observations[start] = time() if timestamp is None else timestamp
+        self.__observations[start + 1 : start + _FIELDS_PER_OBSERVATION] = array("d", values)
+        self.__next = (self.__next + 1) % self.__size
+        self.__count = min(self.__count + 1, self.__size)
+
+        observed = dict(zip(OBSERVED_KEYS, values))
+        self.__uptime_mean = self.__update_mean(self.__uptime_mean, observed["upTime"])
+        self.__update_latency(observed["latency"])
+
+    @staticmethod
+    def __update_mean(mean: float, value: float) -> float:
+        if isnan(value):
+            return mean
+
+        if isnan(mean):
+            return value
+
+        return mean + EWMA_ALPHA * (value - mean)
+
+    def __update_latency(self, latency: float) -> None:
+        if isnan(latency):
+            return
+
+        if isnan(self.__latency_mean):
+            self.__latency_mean = latency
+            return
+
+        # Exponentially weighted variance, updated together with the mean.
+        diff = latency - self.__latency_mean
+        increment = EWMA_ALPHA * diff
+        self.__latency_mean += increment
+        self.__latency_variance = (1 - EWMA_ALPHA) * (self.__latency_variance + diff * increment)
+
+    @property
+    def score(self) -> float:
+        """
+        Quality score between 0 and 1 from the averaged upTime and latency, 0 if unknown.
+        """
+        if isnan(self.__uptime_mean) or isnan(self.__latency_mean):
+            return 0.0
+
+        uptime_factor = min(max(self.__uptime_mean / 100, 0.0), 1.0)
+        latency_factor = 1 / (1 + max(self.__latency_mean, 0.0) / LATENCY_SCALE_MS)
+        return uptime_factor * latency_factor
+
+    @property
+    def stability(self) -> float:
+        """
+        Stability between 0 and 1 from the relative deviation of the latency, 1 if constant.
+        Needs at least two observations, 0 otherwise.
+        """
+        if self.__count < 2 or isnan(self.__latency_mean):
+            return 0.0
+
+        if self.__latency_mean <= 0:
+            return 1.0
+
+        return 1 / (1 + sqrt(self.__latency_variance) / self.__latency_mean)
+
+    def observations(self) -> list[dict[str, float]]:
+        """
+        Retrieves the stored observations, oldest first.
+        """
+        first = (self.__next - self.__count) % self.__size
+        result = []
+
+        for i in range(self.__count):
+            start = ((first + i) % self.__size) * _FIELDS_PER_OBSERVATION
+            timestamp, *values = self.__observations[start : start + _FIELDS_PER_OBSERVATION]
+            result.append({"time": timestamp, **dict(zip(OBSERVED_KEYS, values))})
+
+        return result
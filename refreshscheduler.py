@@ -0,0 +1,63 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Budgeted refresh of stale cache entries.
+
+Stale entries are queued with a priority from how stale they are and how
+valuable the proxies using them are. A run only refreshes as many of the
+highest priority entries as its request budget allows, so refreshes can run
+often and cheaply instead of rescraping everything.
+"""
+from typing import Any, Optional
+from heapq import heapify, heappop
+
+# Value of a proxy per anonymity level, unknown levels count as transparent.
+ANONYMITY_WEIGHTS = {"transparent": 0.4, "anonymous": 0.7, "elite": 1.0}
+# Staleness of entries that have never been fetched.
+NEW_ENTRY_STALENESS = 10.0
+
+
+def refresh_priority(
+    staleness: Optional[float], score: Optional[float], anonymity: Optional[str]
+) -> float:
+    """
+    Priority of refreshing an entry. Staleness is the entry age relative to its expire time,
+    None for new entries, and score the quality score (0-1) of the proxy using it.
+    """
+    staleness = NEW_ENTRY_STALENESS if staleness is None else staleness
+    anonymity_weight = ANONYMITY_WEIGHTS.get(anonymity, ANONYMITY_WEIGHTS["transparent"])
+    return staleness * (1 + (score or 0)) * anonymity_weight
+
+
+class RefreshScheduler:
+    """
+    Priority queue of stale keys. A key pushed several times keeps its highest priority.
+    """
+
+    def __init__(self, budget: Optional[int] = None) -> None:
+        self.__budget = budget
+        self.__priorities: dict[Any, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.__priorities)
+
+    @property
+    def budget(self) -> Optional[int]:
+        return self.__budget
+
+    def push(self, key: Any, priority: float) -> None:
+        if priority > self.__priorities.get(key, float("-inf")):
+            self.__priorities[key] = priority
+
+    def schedule(self) -> set[Any]:
+        """
+        Retrieves the highest priority keys within the budget, all keys if there is no budget.
+        """
+        if self.__budget is None or self.__budget >= len(self.__priorities):
+            return set(self.__priorities)
+
+        queue = [(-priority, key) for key, priority in self.__priorities.items()]
+        heapify(queue)
+        return {heappop(queue)[1] for _ in range(self.__budget)}
@@ -3,12 +3,23 @@
 *
 * SPDX-License-Identifier: BSD-2-Clause
 """
-from typing import Union, IO
+from typing import Union, IO, Optional, Callable
+from collections import Counter
 from logging import basicConfig, getLogger, Logger
-from aiohttp import ClientSession, ClientError, http_exceptions
-from asynchttprequest import AsyncRequest
+from urllib.parse import urlparse
+from time import monotonic
+from asyncio import TimeoutError as AsyncTimeoutError
+from aiohttp import ClientSession, ClientError, ClientTimeout, http_exceptions
+from asynchttprequest import AsyncRequest, LatencyTracker, hedged_send
 from utility import str_join
-from config import DEFAULT_LOGGER
+from config import DEFAULT_LOGGER, REQUEST_TIMEOUTS
+
+# Minimum number of latency samples of a stage before requests in it are hedged.
+HEDGE_MIN_SAMPLES = 20
+
+# Latency trackers per request stage, used for hedging and latency reports.
+_stage_latencies: dict[str, LatencyTracker] = {}
+_hedge_percentile: Optional[float] = None
 
 
 def get_default_logger() -> Logger:
@@ -28,44 +39,175 @@ def init_logger(level: int, stream: IO) -> None:
     logger.info("Initialized logger")
 
 
-async def log_request(request: AsyncRequest, session: ClientSession) -> Union[str, None]:
+def set_hedge_percentile(percentile: Optional[float]) -> None:
+    """
+    Enables hedged requests after the given latency percentile of each stage, None disables it.
+    """
+    global _hedge_percentile  # pylint: disable=global-statement
+    _hedge_percentile = percentile
+
+
+def get_stage_latency(stage: str) -> LatencyTracker:
+    if stage not in _stage_latencies:
+        _stage_latencies[stage] = LatencyTracker()
+
+    return _stage_latencies[stage]
+
+
+def get_request_timeout(url: str) -> ClientTimeout:
+    """
+    Looks up the configured total timeout for the host of an url, falling back to the default.
+    """
+    host = urlparse(url).hostname
+    return ClientTimeout(total=REQUEST_TIMEOUTS.get(host, REQUEST_TIMEOUTS["default"]))
+
+
+def get_hedge_delay(stage: str) -> Optional[float]:
+    latencies = get_stage_latency(stage)
+
+    if _hedge_percentile is None or len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+
+    return latencies.percentile(_hedge_percentile)
+
+
+class LoggedRequest:
+    """
+    Context manager around sending a request. Logs and suppresses request errors, and on
+    success records the latency for the stage. succeeded tells the outcome afterwards.
+    Cancellation is not suppressed.
+    """
+
+    def __init__(self, request: AsyncRequest, session: ClientSession, stage: str) -> None:
+        base_url = session._base_url  # pylint: disable=protected-access
+        self.url = request.url if base_url is None else str_join(str(base_url), request.url)
+        self.succeeded = False
+        self.__stage = stage
+        self.__start_time = 0.0
+
+    def __enter__(self) -> "LoggedRequest":
+        self.__start_time = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        log = get_default_logger()
+
+        if exc_type is None:
+            self.succeeded = True
+            get_stage_latency(self.__stage).record(monotonic() - self.__start_time)
+            log.debug("Got response from %s", self.url)
+            return False
+
+        if issubclass(exc_type, AsyncTimeoutError):
+            log.warning("Request to %s timed out", self.url)
+
+        elif issubclass(exc_type, (ClientError, http_exceptions.HttpProcessingError)):
+            log.error(
+                "aiohttp exception for %s [%s]: %s",
+                self.url,
+                getattr(exc, "status", None),
+                getattr(exc, "message", None),
+            )
+
+        elif issubclass(exc_type, Exception):
+            log.error(
+                "Non-aiohttp exception occured: %s",
+                getattr(exc, "__dict__", {}),
+                exc_info=(exc_type, exc, traceback),
+            )
+
+        else:
+            return False
+
+        return True
+
+
+async def log_request(
+    request: AsyncRequest, session: ClientSession, stage: str = "default"
+) -> Union[str, None]:
     """
     Logging wrapper around AsyncRequest.send method.
+    Applies the host timeout, hedges slow requests and records the latency for the stage.
+    """
+    response = None
+
+    with LoggedRequest(request, session, stage) as logged:
+        response = await hedged_send(
+            request,
+            session,
+            get_hedge_delay(stage),
+            timeout=get_request_timeout(logged.url),
+        )
+
+    return response
+
+
+async def log_stream_request(
+    request: AsyncRequest,
+    session: ClientSession,
+    handle_chunk: Callable[[bytes], None],
+    stage: str = "default",
+) -> bool:
+    """
+    Logging wrapper around AsyncRequest.stream method.
+    Passes each chunk of the response to handle_chunk, returns False if the request failed.
+    """
+    with LoggedRequest(request, session, stage) as logged:
+        async for chunk in request.stream(session, timeout=get_request_timeout(logged.url)):
+            handle_chunk(chunk)
+
+    return logged.succeeded
+
+
+def log_stage_latencies() -> None:
+    """
+    Logs the p50 and p99 latency of every request stage.
     """
     log = get_default_logger()
-    base_url = session._base_url  # pylint: disable=protected-access
-    request_full_url = request.url if base_url is None else str_join(str(base_url), request.url)
-
-    try:
-        response = await request.send(session)
-
-    except (
-        ClientError,
-        http_exceptions.HttpProcessingError,
-    ) as e:
-        log.error(
-            "aiohttp exception for %s [%s]: %s",
-            request_full_url,
-            getattr(e, "status", None),
-            getattr(e, "message", None),
+
+    for stage, latencies in _stage_latencies.items():
+        if len(latencies) == 0:
+            continue
+
+        log.info(
+            "Stage %s: %d requests, p50 %.3fs, p99 %.3fs",
+            stage,
+            len(latencies),
+            latencies.percentile(50),
+            latencies.percentile(99),
         )
-        return None
 
-    except Exception as e:  # pylint: disable=broad-except
-        log.exception("Non-aiohttp exception occured: %s", getattr(e, "__dict__", {}))
-        return None
 
-    log.debug("Got response from %s", request_full_url)
-    return response
+def log_db_entry_status(entry_status: Counter, db_name: str) -> None:
+    """
+    Logs amount of new, changed and unchanged entries in database during a run.
+    """
+    log = get_default_logger()
+    log.info(
+        "%d new, %d changed and %d unchanged entries in cache %s",
+        entry_status["new"],
+        entry_status["changed"],
+        entry_status["unchanged"],
+        db_name,
+    )
 
 
-def log_db_entry_status(entry_count_diff: int, db_name: str) -> None:
+def log_cache_hit_rates(cache_stats: Counter, cache_name: str) -> None:
     """
-    Logs amount of new entries in database depending on before and after length difference.
+    Logs the hit rate of each cache tier from counts of "memory" and "disk" hits and "miss".
     """
     log = get_default_logger()
+    lookups = sum(cache_stats.values())
+
+    if lookups == 0:
+        log.info("No lookups in %s cache", cache_name)
+        return
 
-    if entry_count_diff > 0:
-        log.info("%d new entries in cache %s", entry_count_diff, db_name)
-    else:
-        log.info("No new entries in cache %s", db_name)
+    log.info(
+        "%s cache: %d lookups, memory hits %.1f%%, disk hits %.1f%%, misses %.1f%%",
+        cache_name,
+        lookups,
+        100 * cache_stats["memory"] / lookups,
+        100 * cache_stats["disk"] / lookups,
+        100 * cache_stats["miss"] / lookups,
+    )
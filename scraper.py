@@ -32,20 +32,44 @@ Custom proxy key value pair:
         "timezone":
         "loc":
         "corruptionindex":
+        "fingerprint": (hash of the source fields the entry was forged from)
+        "history": (QualityHistory.to_data of the latest observations)
+        "score": (quality score between 0 and 1)
+        "stability": (latency stability between 0 and 1)
         "entry_time":
     }
 """
-from typing import Iterable, Any
+from typing import Iterable, Any, Optional, Callable
+from collections import Counter
 from math import ceil
+from time import monotonic
 from datetime import timedelta
 from json import loads
 from aiohttp import ClientSession
-from ipinfo import create_ip_info_parser
-from asynchttprequest import AsyncRequest, run_async_requests, ParseRequest
+from ipinfo import (
+    create_ip_info_parser,
+    usable_ip_info,
+    IpInfoBatcher,
+    IpInfoCache,
+    IP_INFO_RESPONSE_KEYS,
+)
+from asynchttprequest import AsyncRequest, run_async_requests, remaining_time, ParseRequest
 from database import Database
+from asyncdatabase import AsyncDatabase
+from proxyindex import ProxyIndex
+from quality import QualityHistory
+from refreshscheduler import RefreshScheduler, refresh_priority
 from curlget import curl_get_json
-from requestlogging import log_request, get_default_logger, log_db_entry_status
-from utility import try_get_key, extract_keys, str_join
+from jsonstream import JsonArrayStream
+from requestlogging import (
+    log_cache_hit_rates,
+    log_request,
+    log_stream_request,
+    get_default_logger,
+    log_db_entry_status,
+    log_stage_latencies,
+)
+from utility import try_get_key, extract_keys, str_join, fingerprint
 from config import IP_DB_NAME, PROXY_DB_NAME
 
 
@@ -63,6 +87,9 @@ PROXYLIST_RESPONSE_KEYS = (
     "updated_at",
 )
 
+# Proxylist keys an entry is forged from, used to detect changed proxies.
+PROXYLIST_SOURCE_KEYS = (*PROXYLIST_RESPONSE_KEYS, "asn", "isp")
+
 
 def forge_proxy_entry(ip_info: dict[str, str], proxylist: dict[str, str]) -> dict[str, Any]:
     """
@@ -88,30 +115,125 @@ def forge_proxy_entry(ip_info: dict[str, str], proxylist: dict[str, str]) -> dic
     return db_entry
 
 
+def add_quality_observation(db_entry: dict[str, Any], prev_entry: Optional[dict[str, Any]]) -> None:
+    """
+    Adds the entry to the quality history of the proxy carried over from its previous entry,
+    and updates the score and stability of the entry.
+    """
+    history_data = try_get_key("history", prev_entry) if prev_entry is not None else None
+    history = QualityHistory() if history_data is None else QualityHistory.from_data(history_data)
+    history.add(db_entry)
+
+    db_entry["history"] = history.to_data()
+    db_entry["score"] = history.score
+    db_entry["stability"] = history.stability
+
+
+def get_source_fingerprint(ip_info: dict[str, str], proxylist: dict[str, str]) -> str:
+    """
+    Hashes the source fields a proxy entry is forged from.
+    """
+    return fingerprint(
+        {
+            **extract_keys(proxylist, PROXYLIST_SOURCE_KEYS),
+            **extract_keys(ip_info, IP_INFO_RESPONSE_KEYS),
+        }
+    )
+
+
 def create_proxy_data_parser(
-    proxy_db: Database, ip_db: Database, proxy_expire_time: timedelta, ip_expire_time: timedelta
+    proxy_db: AsyncDatabase,
+    ip_cache: IpInfoCache,
+    proxy_expire_time: timedelta,
+    proxy_status: Optional[Counter] = None,
+    ip_status: Optional[Counter] = None,
+    proxy_index: Optional[ProxyIndex] = None,
+    ip_batcher: Optional[IpInfoBatcher] = None,
+    ip_refresh_allowed: Optional[Callable[[str], bool]] = None,
 ) -> ParseRequest:
-    parse_ip_info = create_ip_info_parser(ip_db, ip_expire_time)
+    """
+    Creates a parser storing proxies and their ip info. Counts new, changed and
+    unchanged entries in proxy_status and ip_status, and keeps proxy_index up to date.
+    Only refreshes the expired ip info accepted by ip_refresh_allowed, if given.
+    """
+    proxy_status = Counter() if proxy_status is None else proxy_status
+    parse_ip_info = create_ip_info_parser(
+        ip_cache,
+        ip_status,
+        None if ip_batcher is None else ip_batcher.fetch,
+        ip_refresh_allowed,
+    )
 
     async def parse_proxy_data(session: ClientSession, proxy_data: dict[str, str]) -> None:
         """
         Retrieves and stores a proxies data, including it's ip address data separetly.
+        Proxies with the same source data as their stored entry are not forged again,
+        only their quality history and entry time are updated.
         """
         ip_address = proxy_data["ip"]
-        await parse_ip_info(session, ip_address)
+        ip_entry = await parse_ip_info(session, ip_address)
         ip_and_port = f"{ip_address}:{proxy_data['port']}"
 
-        if proxy_db.key_expired(ip_and_port, proxy_expire_time):
-            ip_info = ip_db.get(ip_address)
-            db_entry = forge_proxy_entry(ip_info, proxy_data)
-            proxy_db.store_entry(ip_and_port, db_entry)
+        prev_entry = await proxy_db.get(ip_and_port)
+
+        if Database.entry_expired(prev_entry, proxy_expire_time):
+            ip_info = usable_ip_info(ip_entry)
+            source_fingerprint = get_source_fingerprint(ip_info, proxy_data)
+
+            if prev_entry is not None and (
+                try_get_key("fingerprint", prev_entry) == source_fingerprint
+            ):
+                proxy_status["unchanged"] += 1
+                # Still an observation of the proxy, the stored entry is only restamped.
+                db_entry = dict(prev_entry)
+            else:
+                proxy_status["new" if prev_entry is None else "changed"] += 1
+                db_entry = forge_proxy_entry(ip_info, proxy_data)
+                db_entry["fingerprint"] = source_fingerprint
+
+            add_quality_observation(db_entry, prev_entry)
+            await proxy_db.store_entry(ip_and_port, db_entry)
+
+            if proxy_index is not None:
+                proxy_index.add(ip_and_port, db_entry)
 
     return parse_proxy_data
 
 
-def fetch_proxylist(page_limit: int, request_limit: int) -> Iterable[dict[str, str]]:
+def create_ip_refresh_triage(
+    proxy_db: AsyncDatabase, ip_cache: IpInfoCache, scheduler: RefreshScheduler
+) -> ParseRequest:
+    """
+    Creates a parser queueing the stale ip info of proxies in the refresh scheduler,
+    prioritized by staleness and the score and anonymity level of the proxy.
+    """
+
+    async def triage_proxy_data(_: ClientSession, proxy_data: dict[str, str]) -> None:
+        ip_address = proxy_data["ip"]
+        # Not a lookup of the scrape itself, left out of the cache stats.
+        ip_entry = await ip_cache.get(ip_address, count=False)
+
+        if not ip_cache.entry_expired(ip_entry):
+            return
+
+        prev_entry = await proxy_db.get(f"{ip_address}:{proxy_data['port']}")
+        score = None if prev_entry is None else try_get_key("score", prev_entry)
+        priority = refresh_priority(
+            ip_cache.staleness(ip_entry), score, try_get_key("anonymityLevel", proxy_data)
+        )
+        scheduler.push(ip_address, priority)
+
+    return triage_proxy_data
+
+
+def fetch_proxylist(
+    page_limit: int, request_limit: int, deadline: Optional[float] = None, stream: bool = False
+) -> Iterable[dict[str, str]]:
     """
     Asynchronosly requests a list of proxies from proxylist.geonode.com.
+    Returns the pages fetched so far if the deadline (seconds) is reached.
+    In stream mode the pages are parsed incrementally while they are received, which keeps
+    memory per request flat for large page limits.
     """
     base_url = "https://proxylist.geonode.com"
     api_ref_template = "/api/proxy-list?limit={}&page={{}}"
@@ -119,8 +241,7 @@ def fetch_proxylist(page_limit: int, request_limit: int) -> Iterable[dict[str, s
     single_proxy_query_url = str_join(base_url, api_ref_template.format(1, 1))
 
     log = get_default_logger()
-    request = AsyncRequest("GET", "", headers={"Accept": "application/json"})
-    responses = []
+    proxies = []
 
     def fetch_page_range():
         # Get the range of page numbers to use for requesting all proxies
@@ -136,8 +257,13 @@ def fetch_proxylist(page_limit: int, request_limit: int) -> Iterable[dict[str, s
         return range(1, request_count + 1)
 
     async def proxylist_request(session: ClientSession, page_number: int):
-        request.url = proxylist_api_template.format(page_number)
-        resp = await log_request(request, session)
+        # Each page gets its own request since a hedged duplicate may be sent later on.
+        request = AsyncRequest(
+            "GET",
+            proxylist_api_template.format(page_number),
+            headers={"Accept": "application/json"},
+        )
+        resp = await log_request(request, session, "proxylist")
 
         # If response is none, an error occurred and the fetch could not be made.
         if resp is None:
@@ -147,14 +273,40 @@ def fetch_proxylist(page_limit: int, request_limit: int) -> Iterable[dict[str, s
         # Response contains a key data with all the proxies data.
         proxylist_data = loads(resp)["data"]
         log.info("Fetched %d proxies from page %d", len(proxylist_data), page_number)
-        responses.append(proxylist_data)
+        proxies.extend(proxylist_data)
 
-    run_async_requests(
-        fetch_page_range(), proxylist_request, base_url=base_url, limit=request_limit
-    )
+    async def proxylist_stream_request(session: ClientSession, page_number: int):
+        request = AsyncRequest(
+            "GET",
+            proxylist_api_template.format(page_number),
+            headers={"Accept": "application/json"},
+        )
+        proxylist_data = JsonArrayStream("data")
+        prev_proxy_count = len(proxies)
 
-    # Each request contains a data key which holds the proxy list.
-    return (proxy_data for proxylist in responses for proxy_data in proxylist)
+        def parse_chunk(chunk: bytes) -> None:
+            proxies.extend(proxylist_data.feed(chunk))
+
+        # Proxies parsed before a failure are kept, they are complete entries.
+        if not await log_stream_request(request, session, parse_chunk, "proxylist"):
+            log.warning("Could not fetch proxylist from %s", request.url)
+            return
+
+        if not proxylist_data.done:
+            log.warning("Proxylist from %s ended before the end of its data", request.url)
+
+        log.info("Fetched %d proxies from page %d", len(proxies) - prev_proxy_count, page_number)
+
+    if not run_async_requests(
+        fetch_page_range(),
+        proxylist_stream_request if stream else proxylist_request,
+        base_url=base_url,
+        limit=request_limit,
+        deadline=deadline,
+    ):
+        log.warning("Deadline reached, using %d fetched proxies", len(proxies))
+
+    return proxies
 
 
 def proxy_scraper(
@@ -163,21 +315,66 @@ def proxy_scraper(
     proxy_expire_time: timedelta,
     ip_expire_time: timedelta,
     limit: int,
+    *,
+    run_deadline: Optional[timedelta] = None,
+    page_limit: int = 100,
+    stream: bool = False,
+    proxy_index: Optional[ProxyIndex] = None,
+    ip_negative_expire_time: Optional[timedelta] = None,
+    ip_cache_size: int = 10000,
+    ip_batcher: Optional[IpInfoBatcher] = None,
+    ip_refresh_budget: Optional[int] = None,
 ):
+    log = get_default_logger()
+    deadline = None if run_deadline is None else monotonic() + run_deadline.total_seconds()
+    proxylist = fetch_proxylist(page_limit, limit, remaining_time(deadline), stream)
 
-    proxylist = fetch_proxylist(100, limit)
+    proxy_status = Counter()
+    ip_status = Counter()
 
-    prev_proxy_db_count = proxy_db.get_count()
-    prev_ip_db_count = ip_db.get_count()
+    # Database access goes through writer and reader threads to not stall the requests.
+    with AsyncDatabase(proxy_db) as async_proxy_db, AsyncDatabase(ip_db) as async_ip_db:
+        ip_cache = IpInfoCache(async_ip_db, ip_expire_time, ip_negative_expire_time, ip_cache_size)
+        ip_refresh_allowed = None
 
-    run_async_requests(
-        proxylist,
-        create_proxy_data_parser(proxy_db, ip_db, proxy_expire_time, ip_expire_time),
-        limit=limit,
-    )
+        # Spend the ip info request budget on the most valuable stale ip addresses.
+        if ip_refresh_budget is not None:
+            scheduler = RefreshScheduler(ip_refresh_budget)
+            run_async_requests(
+                proxylist,
+                create_ip_refresh_triage(async_proxy_db, ip_cache, scheduler),
+                limit=limit,
+                deadline=remaining_time(deadline),
+            )
+            scheduled_ips = scheduler.schedule()
+            ip_refresh_allowed = scheduled_ips.__contains__
+            log.info(
+                "Refreshing %d of %d stale ip addresses within budget %d",
+                len(scheduled_ips),
+                len(scheduler),
+                ip_refresh_budget,
+            )
+
+        if not run_async_requests(
+            proxylist,
+            create_proxy_data_parser(
+                async_proxy_db,
+                ip_cache,
+                proxy_expire_time,
+                proxy_status,
+                ip_status,
+                proxy_index,
+                ip_batcher,
+                ip_refresh_allowed,
+            ),
+            limit=limit,
+            deadline=remaining_time(deadline),
+        ):
+            log.warning("Deadline reached, storing partial results")
+
+    log_stage_latencies()
 
-    # Log new ip and proxies entries.
-    new_proxies_count = proxy_db.get_count() - prev_proxy_db_count
-    new_ips_count = ip_db.get_count() - prev_ip_db_count
-    log_db_entry_status(new_proxies_count, PROXY_DB_NAME)
-    log_db_entry_status(new_ips_count, IP_DB_NAME)
+    # Log new, changed and unchanged ip and proxies entries.
+    log_db_entry_status(proxy_status, PROXY_DB_NAME)
+    log_db_entry_status(ip_status, IP_DB_NAME)
+    log_cache_hit_rates(ip_cache.stats, IP_DB_NAME)
@@ -0,0 +1,171 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+
+Columnar snapshot of the proxy database for vectorized filtering.
+
+A snapshot is a directory with one .npy file per column, which are loaded
+memory mapped. Numeric fields are float32 arrays, protocols a bitmask,
+anonymity level and google small integers, and country and org are
+dictionary encoded: an integer code column and a column of distinct values.
+"""
+from typing import Any, Iterable, Optional
+from os import makedirs
+from os.path import join
+from json import dump, load
+import numpy as np
+from database import Database
+from utility import try_get_key
+
+SNAPSHOT_VERSION = 1
+
+NUMERIC_COLUMNS = ("speed", "latency", "upTime", "responseTime", "score", "stability")
+PROTOCOL_BITS = {"http": 1, "https": 2, "socks4": 4, "socks5": 8}
+ANONYMITY_LEVELS = ("transparent", "anonymous", "elite")
+UNKNOWN_ANONYMITY = 255
+DICTIONARY_COLUMNS = ("country", "org")
+
+
+def to_number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def encode_protocols(protocols: Optional[Iterable[str]]) -> int:
+    return sum(PROTOCOL_BITS.get(protocol, 0) for protocol in set(protocols or ()))
+
+
+def encode_anonymity(level: Optional[str]) -> int:
+    return ANONYMITY_LEVELS.index(level) if level in ANONYMITY_LEVELS else UNKNOWN_ANONYMITY
+
+
+def write_snapshot(proxy_db: Database, path: str) -> int:
+    """
+    Writes all entries of a proxy database as a columnar snapshot directory.
+    Returns the number of rows written.
+    """
+    keys = []
+    numeric = {column: [] for column in NUMERIC_COLUMNS}
+    protocols = []
+    anonymity = []
+    google = []
+    dictionaries = {column: {} for column in DICTIONARY_COLUMNS}
+    codes = {column: [] for column in DICTIONARY_COLUMNS}
+
+    for key in proxy_db.get_entries():
+        entry = proxy_db.get(key)
+
+        if entry is None:
+            continue
+
+        keys.append(key)
+
+        for column in NUMERIC_COLUMNS:
+            numeric[column].append(to_number(try_get_key(column, entry)))
+
+        protocols.append(encode_protocols(try_get_key("protocols", entry)))
+        anonymity.append(encode_anonymity(try_get_key("anonymityLevel", entry)))
+        google.append(bool(try_get_key("google", entry)))
+
+        for column in DICTIONARY_COLUMNS:
+            value = try_get_key(column, entry) or ""
+            codes[column].append(dictionaries[column].setdefault(value, len(dictionaries[column])))
+
+    makedirs(path, exist_ok=True)
+    columns = {
+        "key": np.array(keys, dtype=np.str_),
+        "protocols": np.array(protocols, dtype=np.uint8),
+        "anonymity": np.array(anonymity, dtype=np.uint8),
+        "google": np.array(google, dtype=np.uint8),
+        **{column: np.array(numeric[column], dtype=np.float32) for column in NUMERIC_COLUMNS},
+    }
+
+    for column in DICTIONARY_COLUMNS:
+        columns[column] = np.array(codes[column], dtype=np.uint32)
+        columns[f"{column}_values"] = np.array(list(dictionaries[column]), dtype=np.str_)
+
+    for column, values in columns.items():
+        np.save(join(path, f"{column}.npy"), values)
+
+    with open(join(path, "snapshot.json"), "w", encoding="utf-8") as meta_file:
+        dump({"version": SNAPSHOT_VERSION, "rows": len(keys), "columns": list(columns)}, meta_file)
+
+    return len(keys)
+
+
+class ProxySnapshot:
+    """
+    Memory mapped columns of a snapshot with vectorized filters returning boolean masks.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(join(path, "snapshot.json"), "r", encoding="utf-8") as meta_file:
+            meta = load(meta_file)
+
+        if meta["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {meta['version']} in {path}")
+
+        self.__columns = {
+            column: np.load(join(path, f"{column}.npy"), mmap_mode="r")
+            for column in meta["columns"]
+        }
+        self.__rows = meta["rows"]
+
+    def __len__(self) -> int:
+        return self.__rows
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.__columns[column]
+
+    def dictionary_mask(self, column: str, values: Iterable[str]) -> np.ndarray:
+        """
+        Mask of the rows whose dictionary encoded column has one of the values.
+        """
+        wanted_codes = np.flatnonzero(np.isin(self[f"{column}_values"], list(values)))
+        return np.isin(self[column], wanted_codes)
+
+    def filter(
+        self,
+        google: bool = False,
+        protocols: Optional[Iterable[str]] = None,
+        max_speed: Optional[float] = None,
+        min_anonymity: Optional[str] = None,
+        min_score: Optional[float] = None,
+        countries: Optional[Iterable[str]] = None,
+        exclude_countries: Optional[Iterable[str]] = None,
+    ) -> np.ndarray:
+        """
+        Mask of the rows matching every given filter, the same filters as the json export.
+        """
+        mask = np.ones(self.__rows, dtype=bool)
+
+        if google:
+            mask &= self["google"] == 1
+
+        if protocols is not None:
+            mask &= (self["protocols"] & encode_protocols(protocols)) != 0
+
+        if max_speed is not None:
+            mask &= self["speed"] <= max_speed
+
+        if min_anonymity is not None:
+            levels = self["anonymity"]
+            mask &= (levels >= encode_anonymity(min_anonymity)) & (levels != UNKNOWN_ANONYMITY)
+
+        # A missing score counts as 0, same as in the json export.
+        if min_score is not None:
+            mask &= np.nan_to_num(self["score"]) >= min_score
+
+        if countries is not None:
+            mask &= self.dictionary_mask("country", countries)
+
+        if exclude_countries is not None:
+            mask &= ~self.dictionary_mask("country", exclude_countries)
+
+        return mask
+
+    def keys(self, mask: np.ndarray) -> np.ndarray:
+        return self["key"][mask]
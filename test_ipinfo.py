@@ -0,0 +1,98 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+"""
+import unittest
+from asyncio import gather, wait_for
+from aiohttp import ClientSession, web
+from ipinfo import IpInfoBatcher, NEGATIVE_KEY
+
+
+def ip_info(ip_address: str) -> dict:
+    if ip_address.startswith("10."):
+        return {"ip": ip_address, "bogon": True}
+
+    return {"ip": ip_address, "country": "SE", "org": f"AS1 {ip_address}"}
+
+
+class MockBatchEndpoint:
+    """
+    Local ipinfo.io style batch endpoint, recording the ip addresses of each request.
+    """
+
+    def __init__(self, body=None) -> None:
+        self.body = body
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        ip_addresses = await request.json()
+        self.requests.append(ip_addresses)
+
+        if self.body is not None:
+            return web.Response(text=self.body, content_type="application/json")
+
+        return web.json_response({ip_address: ip_info(ip_address) for ip_address in ip_addresses})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/batch", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/batch"
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+class TestIpInfoBatcher(unittest.IsolatedAsyncioTestCase):
+    async def fetch_all(self, endpoint, ip_addresses, batch_size=100, linger=0.01):
+        await endpoint.start()
+        self.addAsyncCleanup(endpoint.stop)
+        batcher = IpInfoBatcher(endpoint.url, batch_size, linger)
+
+        async with ClientSession() as session:
+            return await wait_for(
+                gather(*(batcher.fetch(session, ip_address) for ip_address in ip_addresses)), 5
+            )
+
+    async def test_fan_out(self):
+        endpoint = MockBatchEndpoint()
+        ip_addresses = ["1.1.1.1", "1.1.1.1", "2.2.2.2", "10.0.0.1", "3.3.3.3"]
+        results = await self.fetch_all(endpoint, ip_addresses, batch_size=2)
+
+        self.assertEqual([len(batch) for batch in endpoint.requests], [2, 2])
+        self.assertEqual(sorted(sum(endpoint.requests, [])), sorted(set(ip_addresses)))
+        self.assertEqual(results[0]["org"], "AS1 1.1.1.1")
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2]["org"], "AS1 2.2.2.2")
+        self.assertEqual(results[3], {NEGATIVE_KEY: "bogon"})
+        self.assertEqual(results[4]["country"], "SE")
+
+    async def test_linger_flushes_partial_batch(self):
+        endpoint = MockBatchEndpoint()
+        results = await self.fetch_all(endpoint, ["1.1.1.1"], batch_size=100)
+
+        self.assertEqual(endpoint.requests, [["1.1.1.1"]])
+        self.assertEqual(results[0]["country"], "SE")
+
+    async def test_invalid_json_resolves_all(self):
+        endpoint = MockBatchEndpoint(body="<html>Too many requests</html>")
+        results = await self.fetch_all(endpoint, ["1.1.1.1", "2.2.2.2", "3.3.3.3"], batch_size=2)
+
+        self.assertEqual(results, [{}, {}, {}])
+
+    async def test_unexpected_json_resolves_all(self):
+        endpoint = MockBatchEndpoint(body="[]")
+        results = await self.fetch_all(endpoint, ["1.1.1.1", "2.2.2.2"])
+
+        self.assertEqual(results, [{}, {}])
+
+
+if __name__ == "__main__":
+    unittest.main()
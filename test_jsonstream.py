@@ -0,0 +1,100 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+"""
+import unittest
+from json import dumps
+from jsonstream import JsonArrayStream
+
+PAGE = {
+    "meta": {"data": [0]},
+    "note": "data",
+    "data": [
+        {"ip": "1.2.3.4", "port": "80", "protocols": ["http", "https"]},
+        {"ip": "5.6.7.8", "city": "Malmö", "escaped": 'a\\"]}'},
+        1.5,
+        -2e3,
+        12,
+        "text",
+        True,
+        None,
+        [],
+    ],
+    "total": 9,
+}
+
+# Escaped quotes and backslashes in the top level object before the array.
+ESCAPED_PAGES = (
+    {"note": '"x', "data": [1, 2]},
+    {
+        "note": '"x',
+        "path": "C:\\dir\\",
+        'quoted "data"': {"data": '"data": ['},
+        "data": [{"ip": "1.2.3.4"}, 2],
+    },
+)
+
+
+def feed_chunks(chunks, key="data"):
+    parser = JsonArrayStream(key)
+    items = [item for chunk in chunks for item in parser.feed(chunk)]
+    return items, parser.done
+
+
+class TestJsonArrayStream(unittest.TestCase):
+    def test_every_split_point(self):
+        raw = dumps(PAGE, ensure_ascii=False).encode("utf-8")
+
+        for split in range(1, len(raw)):
+            with self.subTest(split=split):
+                self.assertEqual(feed_chunks([raw[:split], raw[split:]]), (PAGE["data"], True))
+
+    def test_every_split_point_of_escaped_strings(self):
+        for page in ESCAPED_PAGES:
+            raw = dumps(page).encode("utf-8")
+
+            for split in range(1, len(raw)):
+                with self.subTest(raw=raw, split=split):
+                    self.assertEqual(feed_chunks([raw[:split], raw[split:]]), (page["data"], True))
+
+            chunks = [raw[i : i + 1] for i in range(len(raw))]
+            self.assertEqual(feed_chunks(chunks), (page["data"], True))
+
+    def test_single_bytes(self):
+        raw = dumps(PAGE, ensure_ascii=False).encode("utf-8")
+        chunks = [raw[i : i + 1] for i in range(len(raw))]
+        self.assertEqual(feed_chunks(chunks), (PAGE["data"], True))
+
+    def test_number_split_at_fraction_and_exponent(self):
+        self.assertEqual(feed_chunks([b'{"data": [1.', b"5, 2]}"]), ([1.5, 2], True))
+        self.assertEqual(feed_chunks([b'{"data": [1e', b"2]}"]), ([100.0], True))
+        self.assertEqual(feed_chunks([b'{"data": [tr', b"ue]}"]), ([True], True))
+
+    def test_empty_array(self):
+        self.assertEqual(feed_chunks([b'{"data": [', b"]}"]), ([], True))
+
+    def test_incomplete_array_is_not_done(self):
+        self.assertEqual(feed_chunks([b'{"data": [1, {"a": ']), ([1], False))
+
+    def test_invalid_items_raise(self):
+        for raw in (
+            b'{"data": [1.x, 2]}',
+            b'{"data": [{"a" 1}, 2]}',
+            b'{"data": [1 2]}',
+            b'{"data": [1,]}',
+            b'{"data": [{]}',
+        ):
+            with self.subTest(raw=raw):
+                with self.assertRaises(ValueError):
+                    feed_chunks([raw])
+
+    def test_oversized_item_raises(self):
+        parser = JsonArrayStream("data", max_item_size=16)
+
+        with self.assertRaises(ValueError):
+            list(parser.feed(b'{"data": [{"ip": "' + b"1" * 32))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+"""
+import unittest
+from os.path import join
+from pickle import dumps, loads
+from tempfile import TemporaryDirectory
+from database import Database
+from proxyindex import (
+    ProxyIndex,
+    PROXY_INDEX_KEY,
+    load_proxy_index,
+    parse_asns,
+    save_proxy_index,
+)
+
+ENTRIES = {
+    "9.255.255.255:80": {"country": "US", "org": "AS1 One"},
+    "10.0.0.0:80": {"country": "SE", "org": "AS2 Two;AS2"},
+    "10.0.0.1:80": {"country": "SE", "org": "AS3 Three"},
+    "10.0.0.1:8080": {"country": "SE", "org": "AS3 Three"},
+    "10.0.0.255:3128": {"country": "NO", "org": None},
+    "10.0.1.0:80": {"country": "NO", "org": "AS2 Two"},
+    # Same integer value as 10.0.0.1, only the ip version tells them apart.
+    "::a00:1:80": {"country": "DE", "org": "AS4 Four"},
+    "2001:db8::1:443": {"country": None, "org": "AS5 Five"},
+}
+
+
+def build_index(entries=ENTRIES) -> ProxyIndex:
+    index = ProxyIndex()
+
+    for key, entry in entries.items():
+        index.add(key, entry)
+
+    return index
+
+
+class TestProxyIndex(unittest.TestCase):
+    def test_parse_asns(self):
+        self.assertEqual(parse_asns("AS2 Two;AS2;as9 AS13335"), {2, 13335})
+        self.assertEqual(parse_asns(None), set())
+
+    def test_in_network_bounds(self):
+        index = build_index()
+
+        self.assertEqual(
+            index.in_network("10.0.0.0/24"),
+            {"10.0.0.0:80", "10.0.0.1:80", "10.0.0.1:8080", "10.0.0.255:3128"},
+        )
+        self.assertEqual(index.in_network("10.0.0.255/32"), {"10.0.0.255:3128"})
+        self.assertEqual(index.in_network("10.0.1.0/32"), {"10.0.1.0:80"})
+        self.assertEqual(index.in_network("9.255.255.255/32"), {"9.255.255.255:80"})
+        self.assertEqual(index.in_network("10.0.2.0/24"), set())
+        # Host bits are ignored, same as the --cidr argument.
+        self.assertEqual(index.in_network("10.0.1.7/24"), {"10.0.1.0:80"})
+
+    def test_in_network_separates_ip_versions(self):
+        index = build_index()
+
+        self.assertEqual(len(index.in_network("0.0.0.0/0")), 6)
+        self.assertEqual(index.in_network("::/0"), {"::a00:1:80", "2001:db8::1:443"})
+        self.assertEqual(index.in_network("::a00:0/120"), {"::a00:1:80"})
+        self.assertEqual(index.in_network("2001:db8::/32"), {"2001:db8::1:443"})
+
+    def test_query(self):
+        index = build_index()
+
+        self.assertEqual(len(index.query()), len(ENTRIES))
+        self.assertEqual(index.query(asns=[2]), {"10.0.0.0:80", "10.0.1.0:80"})
+        self.assertEqual(index.query(cidrs=["10.0.0.0/16"], asns=[2]), index.query(asns=[2]))
+        self.assertEqual(
+            index.query(cidrs=["10.0.0.0/16"], exclude_cidrs=["10.0.0.0/24"]), {"10.0.1.0:80"}
+        )
+        self.assertEqual(
+            index.query(countries=["NO", "DE"], asns=[2, 4]), {"10.0.1.0:80", "::a00:1:80"}
+        )
+        self.assertEqual(
+            index.query(cidrs=["10.0.0.0/24"], exclude_countries=["SE"]), {"10.0.0.255:3128"}
+        )
+        self.assertEqual(index.query(countries=["FI"]), set())
+
+    def test_add_replaces_changed_fields(self):
+        index = build_index()
+        index.add("10.0.0.1:80", {"country": "FI", "org": "AS6 Six"})
+
+        self.assertEqual(len(index), len(ENTRIES))
+        self.assertEqual(index.in_countries(["SE"]), {"10.0.0.0:80", "10.0.0.1:8080"})
+        self.assertEqual(index.in_countries(["FI"]), {"10.0.0.1:80"})
+        self.assertEqual(index.in_asns([3]), {"10.0.0.1:8080"})
+        self.assertEqual(index.in_asns([6]), {"10.0.0.1:80"})
+        # The ip address is indexed once, a changed entry keeps its key.
+        self.assertEqual(index.in_network("10.0.0.1/32"), {"10.0.0.1:80", "10.0.0.1:8080"})
+        self.assertEqual(len(index.in_network("0.0.0.0/0")), 6)
+
+        index.add("10.0.0.1:80", {"country": None, "org": None})
+        self.assertEqual(index.in_countries(["FI"]), set())
+        self.assertEqual(index.in_asns([6]), set())
+        self.assertIn("10.0.0.1:80", index)
+
+    def test_data_round_trip(self):
+        index = build_index()
+        # Stored data is pickled by the database, it must not depend on the index class.
+        data = loads(dumps(index.to_data()))
+        self.assertNotIn(b"ProxyIndex", dumps(data))
+
+        restored = ProxyIndex.from_data(data)
+
+        self.assertEqual(len(restored), len(index))
+        self.assertEqual(restored.query(), index.query())
+
+        for cidr in ("10.0.0.0/24", "::/0", "0.0.0.0/0"):
+            self.assertEqual(restored.in_network(cidr), index.in_network(cidr))
+
+        for asn in range(1, 6):
+            self.assertEqual(restored.in_asns([asn]), index.in_asns([asn]))
+
+        # A restored index is updated the same as the original.
+        restored.add("10.0.0.1:80", {"country": "FI", "org": None})
+        self.assertEqual(restored.in_countries(["FI"]), {"10.0.0.1:80"})
+        self.assertEqual(restored.in_asns([3]), {"10.0.0.1:8080"})
+        restored.add("10.0.0.2:80", {"country": "FI", "org": None})
+        self.assertEqual(
+            restored.in_network("10.0.0.0/30"), index.in_network("10.0.0.0/30") | {"10.0.0.2:80"}
+        )
+
+
+class TestLoadProxyIndex(unittest.TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.proxy_db = Database(join(directory.name, "proxy"))
+        self.index_db = Database(join(directory.name, "index"))
+        self.addCleanup(self.proxy_db.close)
+        self.addCleanup(self.index_db.close)
+
+        for key, entry in ENTRIES.items():
+            self.proxy_db.store_entry(key, dict(entry))
+
+    def test_builds_missing_index(self):
+        index = load_proxy_index(self.index_db, self.proxy_db)
+
+        self.assertEqual(index.query(), set(ENTRIES))
+        self.assertEqual(self.index_db.get(PROXY_INDEX_KEY)["generation"], len(ENTRIES))
+
+    def test_loads_index_in_sync(self):
+        save_proxy_index(self.index_db, ProxyIndex(), self.proxy_db)
+
+        # The stored index is used as is while the database is unchanged.
+        self.assertEqual(len(load_proxy_index(self.index_db, self.proxy_db)), 0)
+
+    def test_rebuilds_index_out_of_sync(self):
+        save_proxy_index(self.index_db, ProxyIndex(), self.proxy_db)
+        # Rewriting an entry keeps the key count but moves the generation.
+        self.proxy_db.store_entry("10.0.0.1:80", {"country": "FI", "org": None})
+
+        index = load_proxy_index(self.index_db, self.proxy_db)
+
+        self.assertEqual(len(index), len(ENTRIES))
+        self.assertEqual(index.in_countries(["FI"]), {"10.0.0.1:80"})
+
+    def test_rebuilds_other_version_or_unreadable_index(self):
+        for stored in ({"version": 0, "generation": len(ENTRIES), "index": {}}, {"index": None}):
+            with self.subTest(stored=stored):
+                self.index_db.store_entry(PROXY_INDEX_KEY, stored)
+                index = load_proxy_index(self.index_db, self.proxy_db)
+
+                self.assertEqual(index.query(), set(ENTRIES))
+                self.assertEqual(self.index_db.get(PROXY_INDEX_KEY)["index"], index.to_data())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+* Copyright (c) 2022, William Minidis <william.minidis@protonmail.com>
+*
+* SPDX-License-Identifier: BSD-2-Clause
+"""
+import unittest
+from math import isnan, nan, sqrt
+from pickle import dumps
+from quality import EWMA_ALPHA, HISTORY_SIZE, OBSERVED_KEYS, QualityHistory
+
+
+def observation(latency, uptime=100.0, speed=1.0, response_time=100.0):
+    return {"speed": speed, "latency": latency, "upTime": uptime, "responseTime": response_time}
+
+
+class TestQualityHistory(unittest.TestCase):
+    def test_wraparound_keeps_latest_observations(self):
+        history = QualityHistory()
+        added = HISTORY_SIZE + 5
+
+        for i in range(added):
+            history.add(observation(latency=i), timestamp=i)
+
+        observations = history.observations()
+        self.assertEqual(len(history), HISTORY_SIZE)
+        self.assertEqual([entry["time"] for entry in observations], list(range(5, added)))
+        self.assertEqual([entry["latency"] for entry in observations], list(range(5, added)))
+        self.assertEqual(list(observations[0]), ["time", *OBSERVED_KEYS])
+
+    def test_partially_filled_history(self):
+        history = QualityHistory(size=4)
+        history.add(observation(latency=10), timestamp=1)
+        history.add(observation(latency=20), timestamp=2)
+
+        self.assertEqual([entry["time"] for entry in history.observations()], [1, 2])
+
+    def test_ewma_mean_and_variance(self):
+        history = QualityHistory()
+        latencies = (100.0, 200.0, 50.0, 400.0)
+        mean = latencies[0]
+        variance = 0.0
+
+        for latency in latencies:
+            history.add(observation(latency=latency))
+
+        for latency in latencies[1:]:
+            diff = latency - mean
+            mean += EWMA_ALPHA * diff
+            variance = (1 - EWMA_ALPHA) * (variance + EWMA_ALPHA * diff * diff)
+
+        data = history.to_data()
+        self.assertAlmostEqual(data["latency_mean"], mean)
+        self.assertAlmostEqual(data["latency_variance"], variance)
+        self.assertAlmostEqual(history.stability, 1 / (1 + sqrt(variance) / mean))
+
+    def test_constant_latency_is_stable(self):
+        history = QualityHistory()
+        history.add(observation(latency=100))
+        self.assertEqual(history.stability, 0.0)
+
+        history.add(observation(latency=100))
+        self.assertEqual(history.stability, 1.0)
+
+    def test_score_and_stability_bounds(self):
+        cases = (
+            [observation(nan, nan), observation(nan, nan)],
+            [observation(nan, 100), observation(120, nan)],
+            [observation("?", None), {}],
+            [observation(0, 150), observation(0, 150)],
+            [observation(-50, -10), observation(5000, 50)],
+            [observation(1, 100), observation(1e9, 100), observation(nan, 100)],
+        )
+
+        for entries in cases:
+            with self.subTest(entries=entries):
+                history = QualityHistory()
+
+                for entry in entries:
+                    history.add(entry)
+                    self.assertTrue(0.0 <= history.score <= 1.0)
+                    self.assertTrue(0.0 <= history.stability <= 1.0)
+
+    def test_unknown_values_score_zero(self):
+        history = QualityHistory()
+        history.add(observation(nan, nan))
+        self.assertEqual(history.score, 0.0)
+        self.assertTrue(isnan(history.observations()[0]["latency"]))
+
+    def test_data_round_trip(self):
+        history = QualityHistory(size=4)
+
+        for i in range(6):
+            history.add(observation(latency=100 + 10 * i, uptime=90 - i), timestamp=i)
+
+        data = history.to_data()
+        # Stored data is pickled by the database, it must not depend on the history class.
+        self.assertNotIn(b"QualityHistory", dumps(data))
+
+        restored = QualityHistory.from_data(data)
+        self.assertEqual(restored.to_data(), data)
+        self.assertEqual(restored.observations(), history.observations())
+        self.assertEqual((restored.score, restored.stability), (history.score, history.stability))
+
+        # A restored history continues the ring buffer where it was left.
+        history.add(observation(latency=300), timestamp=6)
+        restored.add(observation(latency=300), timestamp=6)
+        self.assertEqual(restored.to_data(), history.to_data())
+        self.assertEqual([entry["time"] for entry in restored.observations()], [3, 4, 5, 6])
+
+    def test_from_data_size_mismatch_raises(self):
+        data = QualityHistory(size=4).to_data()
+        data["size"] = 8
+
+        with self.assertRaises(ValueError):
+            QualityHistory.from_data(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,8 @@ from typing import IO, Union
 from io import TextIOBase
 from typing import Dict, Any, Iterable
 from ipaddress import ip_address, IPv4Address, IPv6Address
-from json import load, loads, JSONDecodeError
+from json import load, loads, dumps, JSONDecodeError
+from hashlib import blake2b
 from scipy.special import comb
 
 
@@ -37,6 +38,14 @@ def is_ipv6(string: str) -> bool:
     return isinstance(result, IPv6Address)
 
 
+def ip_to_int(string: str) -> tuple[int, int]:
+    """
+    Converts an IPv4 or IPv6 address string to its version and packed integer value.
+    """
+    address = ip_address(string)
+    return address.version, int(address)
+
+
 def load_json(stream) -> Union[dict, Exception]:
     try:
         if isinstance(stream, TextIOBase):
@@ -74,3 +83,10 @@ def str_join(*strings, sep="") -> str:
     Joins multiple strings with optional separator.
     """
     return sep.join(strings)
+
+
+def fingerprint(dct: Dict[Any, Any]) -> str:
+    """
+    Creates a short content hash of a json serializable dictionary, independent of key order.
+    """
+    return blake2b(dumps(dct, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()